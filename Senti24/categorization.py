@@ -1,23 +1,106 @@
+import os
+import re
+import json
+import pickle
+import hashlib
+import numpy as np
 import pandas as pd
 import logging
-from nltk import word_tokenize
+import argparse
+from multiprocessing import Pool
 from time import time
 
+try:
+    from Senti24.storage import Database, COLUMN_GROUPS
+    from Senti24.tokenizer import tokenize
+    from Senti24.feature_store import FeatureStore, text_hash
+except:
+    from storage import Database, COLUMN_GROUPS
+    from tokenizer import tokenize
+    from feature_store import FeatureStore, text_hash
+
 """
 Categorizing the thread titles with the simple heuristic
 """
 
 
+# Token classes of the lexicon table. A token belongs to the first matching class, in this order
+QUESTION_MARK, EXCLAMATION_MARK, NEGATION, QUESTION_WORD, SWEAR_WORD, ADJECTIVE = range(1, 7)
+N_CLASSES = 7
+# Lexicon table of a feature extraction process: {token: (class, adjective sentiment)}
+worker_table = None
+
+
+def init_feature_worker(table: dict):
+    """
+    Stores the lexicon table inside a feature extraction process
+    :return: Nothing
+    """
+    global worker_table
+    worker_table = table
+
+
+def extract_chunk(chunk) -> dict:
+    """
+    Extracts the features of a chunk of threads, see Categorizer.extract_features.
+    The tokens of the whole chunk are classified with one table lookup per distinct token,
+    and counted per thread with bincount
+    :param chunk: (texts, titles)
+    :return: {feature: array of values}
+    """
+    texts, titles = chunk
+    n = len(texts)
+    # Texts are documents 0...n-1 and titles n...2n-1
+    docs = [*texts, *titles]
+    tokens = [tokenize(d) for d in docs]
+    n_of_tokens = np.array([len(t) for t in tokens], dtype=np.int64)
+    doc_index = np.repeat(np.arange(2 * n), n_of_tokens)
+    codes, uniques = pd.factorize(pd.Series([t for doc in tokens for t in doc], dtype=object))
+    classes = np.array([worker_table.get(u, (0, 0))[0] for u in uniques], dtype=np.int64)[codes]
+    scores = np.array([worker_table.get(u, (0, 0))[1] for u in uniques], dtype=np.float64)[codes]
+    per_doc = np.bincount(doc_index * N_CLASSES + classes, minlength=2 * n * N_CLASSES).reshape(2 * n, N_CLASSES)
+    per_thread = (per_doc[:n] + per_doc[n:]).astype(np.int32)
+    words = n_of_tokens - per_doc[:, QUESTION_MARK] - per_doc[:, EXCLAMATION_MARK]
+
+    pos = (classes == ADJECTIVE) & (scores > 0)
+    neg = (classes == ADJECTIVE) & (scores < 0)
+    pos_sum = np.bincount(doc_index[pos] % n, weights=scores[pos], minlength=n)
+    neg_sum = np.bincount(doc_index[neg] % n, weights=scores[neg], minlength=n)
+    n_of_pos_adj = np.bincount(doc_index[pos] % n, minlength=n).astype(np.int32)
+    n_of_neg_adj = np.bincount(doc_index[neg] % n, minlength=n).astype(np.int32)
+    return {
+        'title_length': np.array([len(t) for t in titles], dtype=np.int32),
+        'text_length': np.array([len(t) for t in texts], dtype=np.int32),
+        'n_of_words_title': words[n:].astype(np.int32),
+        'n_of_words_text': words[:n].astype(np.int32),
+        'n_of_question_marks': per_thread[:, QUESTION_MARK],
+        'n_of_exclamation_marks': per_thread[:, EXCLAMATION_MARK],
+        'n_of_question_words': per_thread[:, QUESTION_WORD],
+        'n_of_swear_words': per_thread[:, SWEAR_WORD],
+        'n_of_negatives': per_thread[:, NEGATION],
+        'n_of_neg_adjectives': n_of_neg_adj,
+        'n_of_pos_adjectives': n_of_pos_adj,
+        'neg_adj_avg_sentiment': np.divide(neg_sum, n_of_neg_adj, out=np.zeros(n), where=neg_sum != 0),
+        'pos_adj_avg_sentiment': np.divide(pos_sum, n_of_pos_adj, out=np.zeros(n), where=pos_sum != 0),
+    }
+
+
 class Categorizer:
-    def __init__(self, data):
+    def __init__(self, data, database: str = 'data/database', workers: int = 1, chunk_size: int = 100000,
+                 feature_store: str = 'data/features.parquet'):
         self.logger = logging.getLogger('Categorizer')
         self.data = data
+        self.database = Database(database)
+        # Number of feature extraction processes, and the number of threads given to one at a time
+        self.workers = workers
+        self.chunk_size = chunk_size
         # Load related data
         self.logger.info('Loading word data')
-        self.sentiadjs = self.load_sentiadjs()
-        self.questions = self.load_wordfile('data/q_words.txt')
-        self.negations = self.load_wordfile('data/neg_words.txt')
-        self.swears = self.load_wordfile('data/swearing.txt')
+        self.lexicon_files = ['data/neg_words.txt', 'data/q_words.txt', 'data/swearing.txt',
+                              'data/adjectives_and_sentiments.csv']
+        self.table = self.load_lexicon_table()
+        # Features of already categorized threads, valid as long as the lexicons stay the same
+        self.store = FeatureStore(feature_store, self.lexicon_version())
 
         self.features = ['title_length', 'text_length', 'n_of_words_title', 'n_of_words_text',
                          'n_of_question_marks', 'n_of_exclamation_marks', 'n_of_question_words',
@@ -45,100 +128,106 @@ class Categorizer:
             + Average of the sentiments of the negative adjectives
         """
         self.logger.info(f'Extracting features from {len(texts)} threads, this will take a while...')
-        for i, text in enumerate(texts):
-            if i % 100000 == 0:
-                self.logger.info(f"Feature extraction in process for thread number %s" % str(i + 1))
-            title = titles[i]
-            self.feature_val_dict['title_length'].append(len(title))
-            self.feature_val_dict['text_length'].append(len(text))
-
-            text_tokens = word_tokenize(text)
-            title_tokens = word_tokenize(title)
-
-            self.feature_val_dict['n_of_words_title'].append(len([t for t in title_tokens if t != '?' and t != '!']))
-            self.feature_val_dict['n_of_words_text'].append(len([t for t in text_tokens if t != '?' and t != '!']))
-
-            all_tokens = [*text_tokens, *title_tokens]
-            n_of_qmarks = 0
-            n_of_emarks = 0
-            n_of_qwords = 0
-            n_of_swords = 0
-            n_of_negatives = 0
-            n_of_neg_adj = 0
-            n_of_pos_adj = 0
-            neg_adj_s_sum = 0
-            pos_adj_s_sum = 0
-
-            for t in all_tokens:
-                if t == '?':
-                    n_of_qmarks += 1
-                elif t == '!':
-                    n_of_emarks += 1
-                elif self.negations.get(t, 0) != 0:
-                    n_of_negatives += 1
-                elif self.questions.get(t, 0) != 0:
-                    n_of_qwords += 1
-                elif self.swears.get(t, 0) != 0:
-                    n_of_swords += 1
-                else:
-                    adj_s = self.sentiadjs.get(t, 0)
-                    if adj_s > 0:
-                        n_of_pos_adj += 1
-                        pos_adj_s_sum += adj_s
-                    elif adj_s < 0:
-                        n_of_neg_adj += 1
-                        neg_adj_s_sum += adj_s
-
-            self.feature_val_dict['n_of_question_marks'].append(n_of_qmarks)
-            self.feature_val_dict['n_of_exclamation_marks'].append(n_of_emarks)
-            self.feature_val_dict['n_of_question_words'].append(n_of_qwords)
-            self.feature_val_dict['n_of_swear_words'].append(n_of_swords)
-            self.feature_val_dict['n_of_negatives'].append(n_of_negatives)
-            self.feature_val_dict['n_of_neg_adjectives'].append(n_of_neg_adj)
-            self.feature_val_dict['n_of_pos_adjectives'].append(n_of_pos_adj)
-
-            self.feature_val_dict['neg_adj_avg_sentiment'].append(
-                neg_adj_s_sum / n_of_neg_adj if neg_adj_s_sum != 0 else 0)
-            self.feature_val_dict['pos_adj_avg_sentiment'].append(
-                pos_adj_s_sum / n_of_pos_adj if pos_adj_s_sum != 0 else 0)
+        texts = np.asarray(texts, dtype=object)
+        titles = np.asarray(titles, dtype=object)
+        chunks = [(texts[i:i + self.chunk_size], titles[i:i + self.chunk_size])
+                  for i in range(0, len(texts), self.chunk_size)]
+        if self.workers > 1 and len(chunks) > 1:
+            self.logger.info(f'Using {self.workers} worker processes for {len(chunks)} chunks')
+            # The lexicon table is sent to each worker once, and the chunks come back in their original order
+            with Pool(self.workers, initializer=init_feature_worker, initargs=(self.table,)) as pool:
+                results = self.log_progress(pool.imap(extract_chunk, chunks))
+        else:
+            init_feature_worker(self.table)
+            results = self.log_progress(map(extract_chunk, chunks))
+        for feat in self.features:
+            self.feature_val_dict[feat] = np.concatenate([r[feat] for r in results]) if len(results) > 0 else []
 
-    def categorize_with_simple_heuristic(self):
+    def log_progress(self, results) -> [dict]:
+        """
+        Collects the features of the chunks, logging the progress
+        :param results: Iterator of chunk features
+        :return: List of chunk features
+        """
+        collected = []
+        done = 0
+        for r in results:
+            collected.append(r)
+            done += len(r['title_length'])
+            self.logger.info(f'Feature extraction in process, {done} threads done')
+        return collected
+
+    def feature_column(self, name: str) -> np.ndarray:
+        """
+        :param name: Column of the data
+        :return: The column as a float array, missing values as NaN
+        """
+        return self.data[name].to_numpy(dtype=float, na_value=np.nan)
+
+    def load_rules(self, file: str = 'data/category_rules.json') -> dict:
+        """
+        Loads the category rule sets. Each rule set has named definitions, an ordered list of
+        [category, condition] rules, and a default category. Conditions and definitions are expressions over
+        the feature columns (e.g. "(n_of_question_words > 0) & (n_of_words_text < 40)"), and may use
+        the definitions given before them. The first matching rule decides the category
+        :param file: Path to the rule file
+        :return: {rule set: {'definitions': {name: expression}, 'rules': [[category, expression]], 'default': str}}
+        """
+        self.logger.info(f'Reading {file}')
+        with open(file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def categorize_with_rules(self, rule_sets: [str] = None, file: str = 'data/category_rules.json') -> pd.DataFrame:
+        """
+        Categorizes every thread with each of the given rule sets. The feature columns the rules use are read
+        once, and every rule is evaluated for all threads at once
+        :param rule_sets: Names of the rule sets in the rule file, all of them if None
+        :param file: Path to the rule file
+        :return: One column of categories for each rule set
         """
-        Decides the main category of each thread with simple if else rules
-        """
-        categories = []
-        for i in range(len(self.data)):
-            if i % 100000 == 0:
-                self.logger.info(f"Categorized %s threads" % str(i + 1))
-            thread = self.data.iloc[i]
-            if thread.n_of_words_text > 300:
-                if thread.text_s_sum < -2 or thread.n_of_swear_words > 20 or (
-                        thread.n_of_neg_adjectives > 10 and thread.n_of_neg_adjectives > thread.n_of_pos_adjectives):
-                    categories.append('Negative Narration')
-                elif thread.text_s_sum > 2 or (
-                        thread.n_of_pos_adjectives > 10 and thread.n_of_pos_adjectives > thread.n_of_neg_adjectives):
-                    categories.append('Positive Narration')
-                else:
-                    categories.append('Narration')
-            elif thread.n_of_question_words > 0 and thread.n_of_question_marks > 0 and thread.n_of_words_text < 40:
-                categories.append('Question')
-            elif thread.pos_adj_avg_sentiment >= 1.5 or thread.text_s_sum >= 3 or (
-                    thread.n_of_pos_adjectives > 10 and thread.n_of_pos_adjectives > thread.n_of_neg_adjectives):
-                categories.append('Appreciation')
-            elif thread.neg_adj_avg_sentiment <= -1.5 or thread.text_s_sum <= -3 or thread.n_of_swear_words > 10 or (
-                    thread.n_of_neg_adjectives > 10 and thread.n_of_neg_adjectives > thread.n_of_pos_adjectives):
-                categories.append('Negative Reaction')
-            else:
-                categories.append('Announcement')
+        rules = self.load_rules(file)
+        rule_sets = list(rules) if rule_sets is None else rule_sets
+        expressions = [e for name in rule_sets for e in [*rules[name].get('definitions', {}).values(),
+                                                         *[cond for _, cond in rules[name]['rules']]]]
+        names = {n for e in expressions for n in re.findall(r'[A-Za-z_]\w*', e)}
+        features = pd.DataFrame({col: self.feature_column(col) for col in self.data.columns if col in names})
+        self.logger.info(f"Categorizing {len(features)} threads with the rule sets {rule_sets}")
+        categories = pd.DataFrame(index=self.data.index)
+        for name in rule_sets:
+            rule_set = rules[name]
+            env = features.copy(deep=False)
+            for definition, expression in rule_set.get('definitions', {}).items():
+                env[definition] = self.evaluate(env, expression, name)
+            conditions = [self.evaluate(env, cond, name) for _, cond in rule_set['rules']]
+            choices = [category for category, _ in rule_set['rules']]
+            categories[name] = np.select(conditions, choices, default=rule_set['default']).astype(object)
         return categories
 
+    def evaluate(self, env: pd.DataFrame, expression: str, rule_set: str) -> np.ndarray:
+        """
+        :param env: Feature columns and the definitions of the rule set
+        :param expression: Condition of a rule
+        :param rule_set: Name of the rule set, for the error message
+        :return: Boolean mask of the threads matching the condition, missing values never match
+        """
+        try:
+            return np.asarray(env.eval(expression), dtype=bool)
+        except Exception as e:
+            raise ValueError(f'Rule set {rule_set}: cannot evaluate {expression!r}: {e}')
+
+    def categorize_with_simple_heuristic(self):
+        """
+        Decides the main category of each thread with the simple heuristic rules of data/category_rules.json
+        """
+        return self.categorize_with_rules(['simple_heuristic'])['simple_heuristic'].values
+
     def categorize_main(self):
         """
         Main function for categorizing
         """
         start = time()
         self.logger.info("Starting to extract features")
-        self.extract_features(self.data.text, self.data.title)
+        self.load_features()
         self.logger.info(f'Done extracting, took {time()-start}s')
 
         self.logger.info("Adding the extracted features to the data frame")
@@ -150,10 +239,80 @@ class Categorizer:
         self.data['simple_heuristic_cat'] = self.categorize_with_simple_heuristic()
         self.logger.info(f'Done categorizing, took {time()-start2}s')
 
-        self.logger.info("Categories added to the data frame, and now saving the data frame")
-        self.data.to_csv('data/database.csv', index=False)
+        self.logger.info("Categories added to the data frame, and now saving the new columns")
+        self.database.write(self.data, 'categorization', [*self.features, 'simple_heuristic_cat'])
         self.logger.info(f'Categorization done! Whole process took {time()-start}s')
 
+    def load_features(self):
+        """
+        Takes the features of known threads from the feature store, and extracts them only for threads
+        that are new, whose title or text has changed, or that were extracted with other lexicons
+        :return: Nothing, the features are put into feature_val_dict
+        """
+        keys = pd.DataFrame({'thread_id': self.data['thread_id'].values, 'text_hash': text_hash(self.data)})
+        features = self.store.get(keys)
+        for feat in self.features:
+            if feat not in features:
+                features[feat] = np.nan
+        missing = features[self.features].isna().any(axis=1).values
+        self.logger.info(f'Features of {len(keys)-missing.sum()} threads found in the feature store')
+        if missing.any():
+            self.extract_features(self.data['text'].values[missing], self.data['title'].values[missing])
+            extracted = keys[missing].reset_index(drop=True)
+            for feat in self.features:
+                extracted[feat] = self.feature_val_dict[feat]
+            self.store.put(extracted)
+            for feat in self.features:
+                features[feat] = features[feat].astype(float)
+                features.loc[missing, feat] = extracted[feat].values
+        for feat in self.features:
+            self.feature_val_dict[feat] = features[feat].values
+
+    def lexicon_version(self) -> str:
+        """
+        :return: Hash of the lexicon files, changes whenever one of them is edited
+        """
+        h = hashlib.sha1()
+        for file in self.lexicon_files:
+            with open(file, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def load_lexicon_table(self, file: str = 'data/categorization_lexicons.pkl') -> dict:
+        """
+        Loads the compiled lexicon table, compiling and saving it again if the lexicon files have changed
+        :param file: Path to the compiled table
+        :return: {token: (class, adjective sentiment)}
+        """
+        version = self.lexicon_version()
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                compiled = pickle.load(f)
+            if compiled['version'] == version:
+                self.logger.info(f'Loaded the lexicon table from {file}')
+                return compiled['table']
+        table = self.compile_lexicon_table()
+        with open(file + '.tmp', 'wb') as f:
+            pickle.dump({'version': version, 'table': table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file + '.tmp', file)
+        self.logger.info(f'Compiled {len(table)} tokens into {file}')
+        return table
+
+    def compile_lexicon_table(self) -> dict:
+        """
+        Combines the lexicons into one table. A token in several lexicons gets the class that is checked first:
+        question and exclamation marks, negations, question words, swear words and last adjectives.
+        Adjectives without a sentiment are left out, as they are never counted
+        :return: {token: (class, adjective sentiment)}
+        """
+        table = {word: (ADJECTIVE, s) for word, s in self.load_sentiadjs().items() if s > 0 or s < 0}
+        table.update((word, (SWEAR_WORD, 0)) for word in self.load_wordfile('data/swearing.txt'))
+        table.update((word, (QUESTION_WORD, 0)) for word in self.load_wordfile('data/q_words.txt'))
+        table.update((word, (NEGATION, 0)) for word in self.load_wordfile('data/neg_words.txt'))
+        table['!'] = (EXCLAMATION_MARK, 0)
+        table['?'] = (QUESTION_MARK, 0)
+        return table
+
     def load_sentiadjs(self) -> pd.DataFrame:
         """
         Loads the adjective sentiment dataframe
@@ -183,5 +342,19 @@ if __name__ == '__main__':
     # Initialize logging into the file "categorization.log"
     logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
                         datefmt='%H:%M:%S', filename='logs/categorization.log', filemode='w')
-    data = pd.read_csv("data/database.csv")
-    Categorizer(data).categorize_main()
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', nargs='*', help='Compare rule sets of data/category_rules.json (all if none given) '
+                                              'on the stored features, instead of categorizing')
+    args = parser.parse_args()
+    if args.r is not None:
+        # Only the features are needed, the texts are not tokenized again
+        data = Database().read(['text_s_sum', *COLUMN_GROUPS['categorization']])
+        categories = Categorizer(data).categorize_with_rules(args.r or None)
+        counts = categories.apply(pd.Series.value_counts).fillna(0).astype(int)
+        counts.index.name = 'category'
+        counts.to_csv('data/rule_comparison.csv')
+        print(counts.to_string())
+    else:
+        data = Database().read(text_dtype='string[pyarrow]')
+        Categorizer(data, workers=os.cpu_count()).categorize_main()
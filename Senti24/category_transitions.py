@@ -1,7 +1,13 @@
 import logging
+import numpy as np
 import pandas as pd
 from time import time
 
+try:
+    from Senti24.storage import Database
+except:
+    from storage import Database
+
 
 class CategoryTransitions:
     def __init__(self, data: pd.DataFrame, save_to: str):
@@ -9,32 +15,37 @@ class CategoryTransitions:
         self.data = data
         self.save_to = save_to
 
-    def calculate_category_transitions(self, categories):
+    def transition_matrix(self, categories) -> pd.DataFrame:
         """
-        Calculates all category transitions. Assumes that the given column of categories is
+        Counts the transitions between consecutive threads. Assumes that the given column of categories is
         in the right order, i.e., the threads are organized in an ascending order by datetime.
+        The categories are turned into integer codes, and every pair of consecutive codes is counted with one bincount
+        :param categories: Category of each thread
+        :return: K x K table of transition counts, rows are the categories transitioned from. Categories are in
+                 the order of their first appearance
+        """
+        codes, uniques = pd.factorize(categories, sort=False, use_na_sentinel=False)
+        k = len(uniques)
+        counts = np.bincount(codes[:-1] * k + codes[1:], minlength=k * k).reshape(k, k)
+        uniques = np.asarray(uniques, dtype=object)
+        return pd.DataFrame(counts, index=uniques, columns=uniques)
+
+    def calculate_category_transitions(self, categories):
+        """
+        Calculates all category transitions, see transition_matrix.
         Return dictionary where keys are transition pairs, e.g. (Question, Announcement), and
         values are the number of occurrences for each transition pair
         """
-        unique_cats = categories.unique()
-        transition_counts = {}
-
-        for c1 in unique_cats:
-            for c2 in unique_cats:
-                transition_counts[(c1, c2)] = 0
-
-        for i in range(len(categories) - 1):
-            transition_counts[(categories[i], categories[i + 1])] += 1
-
-        return transition_counts
+        table = self.transition_matrix(categories)
+        return {(c1, c2): int(table.iat[i, j]) for i, c1 in enumerate(table.index)
+                for j, c2 in enumerate(table.columns)}
 
     def cross_table(self, unique_cats, transitions):
         """
         Forms a cross table for transition counts, and saves it as a csv file
         """
-        table = pd.DataFrame(columns=unique_cats, index=unique_cats)
-        for k, v in transitions.items():
-            table.loc[k[0], k[1]] = v
+        table = pd.DataFrame([[transitions[(c1, c2)] for c2 in unique_cats] for c1 in unique_cats],
+                             index=unique_cats, columns=unique_cats)
         table.to_csv(f'{self.save_to}')
 
     def get_transitions(self):
@@ -44,17 +55,17 @@ class CategoryTransitions:
         """
         start = time()
         self.logger.info('Starting transition calculation')
-        t_counts = self.calculate_category_transitions(self.data)
+        table = self.transition_matrix(self.data)
         self.logger.info(f'Done calculating transitions, took {time()-start}s')
         self.logger.info(f'Saving result to {self.save_to}')
-        self.cross_table(self.data.unique(), t_counts)
+        table.to_csv(f'{self.save_to}')
         self.logger.info('Results saved!')
 
 
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
                         datefmt='%H:%M:%S', filename='logs/category-transitions.log', filemode='w')
-    data = pd.read_csv('data/database.csv')
+    data = Database().read(['simple_heuristic_cat'])
     ct = CategoryTransitions(data.simple_heuristic_cat, 'data/simple_transitions.csv')
     ct.get_transitions()
 
@@ -0,0 +1,79 @@
+import os
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from time import time
+
+try:
+    from Senti24.storage import apply_schema
+except:
+    from storage import apply_schema
+
+"""
+Store of the features extracted by the Categorizer. Rows are keyed by thread_id and a hash of the title and text,
+only the latest features of each thread are kept, and the whole store is tied to the version of the lexicons,
+so only new, edited, or re-lexiconed threads have to be tokenized again
+"""
+
+KEYS = ['thread_id', 'text_hash']
+
+
+def text_hash(data: pd.DataFrame):
+    """
+    :param data: Threads with the columns title and text
+    :return: 64-bit hash of the title and text of each thread
+    """
+    return pd.util.hash_pandas_object(data[['title', 'text']].astype(object), index=False).values
+
+
+class FeatureStore:
+    def __init__(self, path: str = 'data/features.parquet', version: str = ''):
+        self.logger = logging.getLogger('feature-store')
+        self.path = path
+        self.version = version
+
+    def load(self) -> pd.DataFrame:
+        """
+        :return: Stored features, or None if there are none for this version of the lexicons
+        """
+        if not os.path.exists(self.path):
+            return None
+        metadata = pq.read_schema(self.path).metadata or {}
+        if metadata.get(b'version', b'').decode('utf-8') != self.version:
+            self.logger.info(f'{self.path} was made with other lexicons, ignoring it')
+            return None
+        return pd.read_parquet(self.path)
+
+    def get(self, keys: pd.DataFrame) -> pd.DataFrame:
+        """
+        Looks up the features of the given threads
+        :param keys: thread_id and text_hash of each thread
+        :return: Features in the same order as keys, missing rows are empty
+        """
+        start = time()
+        stored = self.load()
+        if stored is None:
+            return keys[KEYS].reset_index(drop=True)
+        features = keys[KEYS].reset_index(drop=True).merge(stored, how='left', on=KEYS)
+        self.logger.info(f'Looked up the features of {len(keys)} threads, took {time()-start}s')
+        return features
+
+    def put(self, features: pd.DataFrame):
+        """
+        Adds features to the store, replacing older features of the same threads, so an edited thread
+        doesn't leave its old features behind
+        :param features: thread_id, text_hash and the features of each thread
+        :return: Nothing
+        """
+        start = time()
+        stored = self.load()
+        if stored is not None:
+            features = pd.concat([stored, features], ignore_index=True)
+        features = features.drop_duplicates('thread_id', keep='last').reset_index(drop=True)
+        table = pa.Table.from_pandas(apply_schema(features), preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), b'version': self.version.encode('utf-8')}
+        table = table.replace_schema_metadata(metadata)
+        pq.write_table(table, self.path + '.tmp')
+        os.replace(self.path + '.tmp', self.path)
+        self.logger.info(f'Stored the features of {len(features)} threads in {self.path}, took {time()-start}s')
@@ -1,52 +1,96 @@
+import os
+import joblib
 import logging
+import argparse
 from time import time
+import numpy as np
 import pandas as pd
 from pandas.core.common import SettingWithCopyWarning
 import warnings
 from random import sample, seed
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
 
 try:
     from Senti24.zipfs_law import ZipfsLaw
     from Senti24.category_transitions import CategoryTransitions
+    from Senti24.storage import Database
 except:
     from zipfs_law import ZipfsLaw
     from category_transitions import CategoryTransitions
+    from storage import Database
 
 """
 K-Means categorization of the threads
 """
 
+# Categories of the 6 clusters, determined manually from the feature distributions of each cluster
+CLUSTER_CATEGORIES = ['Short Text', 'Question', 'Negative text', 'Announcement', 'Question/Descriptive', 'Rant']
+# Features the threads are clustered by
+KMEANS_FEATURES = [  # 'title_s_sum','text_s_sum',
+    'senti_avg',  # 'title_length', 'text_length',
+    'n_of_words_title', 'n_of_words_text',
+    'n_of_question_marks', 'n_of_exclamation_marks',
+    'n_of_question_words', 'n_of_swear_words',
+    'n_of_negatives', 'n_of_neg_adjectives', 'n_of_pos_adjectives',
+    # 'neg_adj_avg_sentiment', 'pos_adj_avg_sentiment'
+]
+# Version of the saved model file, increase when its contents change
+MODEL_VERSION = 1
+
+
+def in_sorted(values: np.ndarray, sorted_ids: np.ndarray) -> np.ndarray:
+    """
+    Membership test against ids that are already sorted, unlike np.isin they are not sorted again on every call
+    :param values: Ids to look up
+    :param sorted_ids: Sorted ids
+    :return: True for each value found in sorted_ids
+    """
+    if len(sorted_ids) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_ids, values).clip(max=len(sorted_ids) - 1)
+    return sorted_ids[positions] == values
+
 
 class KmeansCategorization:
-    def __init__(self, data: pd.DataFrame):
+    def __init__(self, data: pd.DataFrame = None, data_version: str = None):
+        """
+        :param data: Threads with the K-means features
+        :param data_version: Version of the features in the database (Database.version(KMEANS_FEATURES)), saved with
+                             the model so a model trained on other features is not used. Not checked if None
+        """
         self.logger = logging.getLogger('kmeans')
         self.data = data
-        self.ids_by_year = self.load_thread_ids()
-        self.features = [  # 'title_s_sum','text_s_sum',
-            'senti_avg',  # 'title_length', 'text_length',
-            'n_of_words_title', 'n_of_words_text',
-            'n_of_question_marks', 'n_of_exclamation_marks',
-            'n_of_question_words', 'n_of_swear_words',
-            'n_of_negatives', 'n_of_neg_adjectives', 'n_of_pos_adjectives',
-            # 'neg_adj_avg_sentiment', 'pos_adj_avg_sentiment'
-        ]
+        self.data_version = data_version
+        self.ids_by_year, self.all_ids = self.load_thread_ids()
+        self.features = KMEANS_FEATURES
+        self.categories = CLUSTER_CATEGORIES
 
-    def load_thread_ids(self) -> [int]:
+    def load_thread_ids(self, cache: str = 'data/thread_ids.npz') -> ([np.ndarray], np.ndarray):
         """
-        Reads the ids of threads from which adjectives were extracted
-        :return: List of ids
+        Reads the ids of threads from which adjectives were extracted. The ids are kept as integer arrays in
+        a binary cache, which is rebuilt when one of the text files changes
+        :param cache: Path to the cache
+        :return: Array of ids for each year in the order of the files, and all ids sorted
         """
         self.logger.info('Loading thread ids')
         ids_files = [r'data/20{:02}_ids.txt'.format(i + 1) for i in range(8, 17)]
-        ids_by_year = []
-        for fname in ids_files:
-            with open(fname, 'r') as f:
-                ids_by_year.append([x.rstrip() for x in f.readlines()])
+        sources = np.array([f'{f}:{os.stat(f).st_size}:{os.stat(f).st_mtime_ns}' for f in ids_files])
+        if os.path.exists(cache):
+            with np.load(cache) as cached:
+                if 'all_ids' in cached.files and np.array_equal(cached['sources'], sources):
+                    self.logger.info(f'Thread ids loaded from {cache}')
+                    return [cached[f'ids_{i}'] for i in range(len(ids_files))], cached['all_ids']
+        ids_by_year = [np.loadtxt(fname, dtype=np.int64, ndmin=1) for fname in ids_files]
+        all_ids = np.sort(np.concatenate(ids_by_year))
+        with open(cache + '.tmp', 'wb') as f:
+            np.savez(f, sources=sources, all_ids=all_ids, **{f'ids_{i}': ids for i, ids in enumerate(ids_by_year)})
+        os.replace(cache + '.tmp', cache)
         self.logger.info('Thread ids loaded')
-        return ids_by_year
+        return ids_by_year, all_ids
 
     def elbow_method(self):
         """
@@ -100,6 +144,16 @@ class KmeansCategorization:
             plt.show()
             input('Press enter to continue')
 
+    def sample_ids(self) -> (np.ndarray, np.ndarray):
+        """
+        Takes 50000 threads of each year for training. Sampling positions draws the same threads as sampling
+        the lists of ids did
+        :return: Training ids and all ids, both sorted for in_sorted
+        """
+        seed(10)
+        train_ids = [ids[sample(range(len(ids)), 50000)] for ids in self.ids_by_year]
+        return np.sort(np.concatenate(train_ids)), self.all_ids
+
     def kmeans_main(self):
         """
         Main function for K-means categorization:
@@ -113,16 +167,12 @@ class KmeansCategorization:
         self.logger.info('Starting K-means')
         start = time()
         warnings.simplefilter(action="ignore", category=SettingWithCopyWarning)
-        seed(10)
-        train_ids = []
-        all_ids = []
-        for l in self.ids_by_year:
-            train_ids.extend(sample(l, 50000))
-            all_ids.extend(l)
-
-        ids_data = self.data[self.data['thread_id'].isin(all_ids)]
-        self.train_data = ids_data[ids_data['thread_id'].isin(train_ids)]
-        self.test_data = ids_data[~ids_data['thread_id'].isin(train_ids)]
+        train_ids, all_ids = self.sample_ids()
+
+        ids_data = self.data[in_sorted(self.data['thread_id'].to_numpy(), all_ids)]
+        is_train = in_sorted(ids_data['thread_id'].to_numpy(), train_ids)
+        self.train_data = ids_data[is_train]
+        self.test_data = ids_data[~is_train]
         # print(len(ids_data), len(self.train_data), len(self.test_data))
 
         self.scaler = StandardScaler().fit(ids_data[self.features])
@@ -137,14 +187,16 @@ class KmeansCategorization:
         all_labels = pd.Series([*self.km_final.labels_, *test_predict])
         self.all_data = pd.concat([self.train_data, self.test_data], ignore_index=True)
 
-        categories = all_labels.replace([0, 1, 2, 3, 4, 5],
-                                        ['Short Text','Question','Negative text','Announcement','Question/Descriptive','Rant'])
+        categories = all_labels.replace(list(range(k)), self.categories)
 
         self.all_data['labels'] = all_labels
         self.all_data['kmeans_cat'] = categories
+        # Categories by the rows of the whole database, empty for threads not categorized by K-means
+        self.data['kmeans_cat'] = pd.Series(categories.values, index=[*self.train_data.index, *self.test_data.index])
         self.all_data = self.all_data.sort_values('datetime')
 
         self.logger.info(f'K-means done, took {time()-start}s')
+        self.save_model()
 
         # print(len(all_labels), len(self.all_data))
         # for i in range(0,k):
@@ -153,6 +205,166 @@ class KmeansCategorization:
         #   print(len(self.all_data[all_labels == i]))
 
 
+    def save_model(self, file: str = 'data/kmeans_model.joblib'):
+        """
+        Saves the fitted scaler and K-means, the categories of the clusters, and the version of the features
+        they were trained on
+        :param file: Path to the model file
+        :return: Nothing
+        """
+        joblib.dump({'version': MODEL_VERSION, 'features': self.features, 'data_version': self.data_version,
+                     'scaler': self.scaler, 'kmeans': self.km_final, 'categories': self.categories}, file + '.tmp')
+        os.replace(file + '.tmp', file)
+        self.logger.info(f'Model saved to {file}')
+
+    def load_model(self, file: str = 'data/kmeans_model.joblib'):
+        """
+        Loads a model saved by save_model
+        :param file: Path to the model file
+        :return: Nothing, raises ValueError if the model can't be used and has to be trained again
+        """
+        model = joblib.load(file)
+        if model.get('version') != MODEL_VERSION or model['features'] != self.features:
+            raise ValueError(f'{file} was saved by another version of the K-means categorization, train it again')
+        if self.data_version is not None and model.get('data_version') != self.data_version:
+            raise ValueError(f'{file} was trained on other features than those in the database, train it again')
+        self.scaler = model['scaler']
+        self.km_final = model['kmeans']
+        self.categories = model['categories']
+        self.logger.info(f'Model loaded from {file}')
+
+    def predict_categories(self, data: pd.DataFrame) -> pd.Series:
+        """
+        Categorizes threads with the fitted model
+        :param data: Threads with the K-means features
+        :return: Category of each thread, empty for threads with missing features
+        """
+        complete = data[self.features].notna().all(axis=1)
+        labels = pd.Series(np.nan, index=data.index)
+        if complete.any():
+            labels[complete] = self.km_final.predict(self.scaler.transform(data.loc[complete, self.features]))
+        return labels.replace(list(range(len(self.categories))), self.categories)
+
+    def kmeans_predict(self, file: str = 'data/kmeans_model.joblib'):
+        """
+        Categorizes the threads with ids using a saved model, without training it again
+        Final data frame is in the variable 'all_data'
+        """
+        self.logger.info('Starting K-means prediction')
+        start = time()
+        self.load_model(file)
+        ids_data = self.data[in_sorted(self.data['thread_id'].to_numpy(), self.all_ids)]
+        categories = self.predict_categories(ids_data)
+        # Categories by the rows of the whole database, empty for threads not categorized by K-means
+        self.data['kmeans_cat'] = categories
+        self.all_data = ids_data.assign(kmeans_cat=categories).sort_values('datetime')
+        self.logger.info(f'K-means prediction done, took {time()-start}s')
+
+    def match_categories(self, file: str = 'data/kmeans_model.joblib') -> bool:
+        """
+        Names the clusters of the fitted model after the clusters of a reference K-means model. Each centroid is
+        paired with one reference centroid so that the total distance between the pairs is smallest, and gets its
+        category. Distances are measured in the standardized units of the reference model
+        :param file: Path to the reference model, saved by kmeans_main
+        :return: True if the clusters were named, False if there is no usable reference model
+        """
+        if not os.path.exists(file):
+            return False
+        reference = joblib.load(file)
+        if reference.get('version') != MODEL_VERSION or reference['features'] != self.features \
+                or reference['kmeans'].n_clusters != self.km_final.n_clusters:
+            return False
+        centers = self.scaler.inverse_transform(self.km_final.cluster_centers_)
+        reference_centers = reference['scaler'].inverse_transform(reference['kmeans'].cluster_centers_)
+        distances = cdist(reference['scaler'].transform(centers), reference['scaler'].transform(reference_centers))
+        _, matches = linear_sum_assignment(distances)
+        self.categories = [reference['categories'][j] for j in matches]
+        self.logger.info(f'Clusters matched to the clusters of {file}: {self.categories}')
+        return True
+
+    def kmeans_streaming(self, database: Database, batch_size: int = 10000, epochs: int = 1,
+                         reference: str = 'data/kmeans_model.joblib',
+                         save_to: str = 'data/kmeans_streaming_model.joblib',
+                         output: str = 'data/kmeans_categorization.csv'):
+        """
+        K-means categorization that reads the database one partition at a time instead of holding it in memory:
+            + Fits the scaler incrementally to the threads with ids
+            + Trains MiniBatchKMeans incrementally with batches of the training threads
+            + Names the clusters by matching them to the clusters of the reference model (see match_categories),
+            as MiniBatchKMeans numbers its clusters differently than KMeans
+            + Predicts the categories of the threads with ids, and writes them to the database partition by
+            partition. Without a reference model the clusters are called 'Cluster 0'... and the database is not changed
+            + Appends the categories to the output file partition by partition, in the order of kmeans_main
+        The model is saved to its own file, so it never replaces the model of kmeans_main. Only one partition is in
+        memory at a time, so nothing is kept in 'all_data'
+        :param database: Database with the sentiment scores and the features of the simple heuristic
+        :param batch_size: Number of training threads per partial fit
+        :param epochs: Number of passes over the training threads
+        :param reference: Path to the model of kmeans_main, used to name the clusters
+        :param save_to: Path the streamed model is saved to
+        :param output: Path to the csv of categories
+        :return: Nothing
+        """
+        self.logger.info('Starting streaming K-means')
+        start = time()
+        self.data_version = database.version(self.features)
+        train_ids, all_ids = self.sample_ids()
+        columns = ['thread_id', 'datetime', 'year', 'month', *self.features]
+
+        def id_rows(df: pd.DataFrame, ids: np.ndarray) -> pd.DataFrame:
+            return df[in_sorted(df['thread_id'].to_numpy(), ids) & df[self.features].notna().all(axis=1).to_numpy()]
+
+        self.scaler = StandardScaler()
+        for year, month, df in database.iter_partitions(columns):
+            rows = id_rows(df, all_ids)
+            if len(rows) > 0:
+                self.scaler.partial_fit(rows[self.features])
+        self.logger.info(f'Scaler fitted, took {time()-start}s')
+
+        k = len(self.categories)
+        self.km_final = MiniBatchKMeans(n_clusters=k, random_state=10, batch_size=batch_size, n_init=3)
+        for epoch in range(epochs):
+            # Partitions are smaller or larger than a batch, so training threads are buffered until a batch is full
+            buffer, buffered = [], 0
+            for year, month, df in database.iter_partitions(columns):
+                rows = id_rows(df, train_ids)
+                # Months without training threads, e.g. those outside the years of the id files
+                if len(rows) == 0:
+                    continue
+                buffer.append(self.scaler.transform(rows[self.features]))
+                buffered += len(rows)
+                if buffered >= batch_size:
+                    self.km_final.partial_fit(np.concatenate(buffer))
+                    buffer, buffered = [], 0
+            if buffered >= k or (buffered > 0 and hasattr(self.km_final, 'cluster_centers_')):
+                self.km_final.partial_fit(np.concatenate(buffer))
+            self.logger.info(f'Epoch {epoch+1} of {epochs} done, took {time()-start}s')
+        named = self.match_categories(reference)
+        if not named:
+            self.logger.info(f'No usable reference model in {reference}, the clusters are not named and '
+                             f'kmeans_cat is not written to the database')
+            self.categories = [f'Cluster {i}' for i in range(k)]
+        self.save_model(save_to)
+
+        self.all_data = None
+        with open(output + '.tmp', 'w', newline='') as f:
+            f.write('kmeans_cat\n')
+            for year, month, df in database.iter_partitions(columns):
+                rows = id_rows(df, all_ids)
+                labels = pd.Series(np.nan, index=df.index)
+                if len(rows) > 0:
+                    labels[rows.index] = self.km_final.predict(self.scaler.transform(rows[self.features]))
+                df['labels'] = labels
+                df['kmeans_cat'] = labels.replace(list(range(k)), self.categories)
+                if named:
+                    database.write(df, 'kmeans', ['kmeans_cat'])
+                # Partitions are in chronological order, so sorting each of them sorts the whole file
+                categories = df.loc[rows.index].sort_values('datetime')['kmeans_cat']
+                categories.to_csv(f, header=False, index=False, lineterminator='\n')
+        os.replace(output + '.tmp', output)
+        self.logger.info(f'Streaming K-means done, categories saved to {output}, took {time()-start}s')
+
+
 if __name__ == '__main__':
     # Initialize logging into the file "logs/kmeans.log"
     logging.basicConfig(filename="logs/kmeans.log",
@@ -168,18 +380,39 @@ if __name__ == '__main__':
     #    with open(fname, 'r') as f:
     #        ids_by_year.append([x.rstrip() for x in f.readlines()])
 
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', action='store_true', help='Stream the database with MiniBatchKMeans instead of '
+                                                        'loading it into memory')
+    parser.add_argument('-p', action='store_true', help='Categorize with the saved model in '
+                                                        'data/kmeans_model.joblib without training')
+    args = parser.parse_args()
+
     #data = pd.read_csv('data/sentiment-data+features.csv')
-    data = pd.read_csv('data/database.csv')
-    km_obj = KmeansCategorization(data)
-    km_obj.kmeans_main()
-    km_obj.all_data.kmeans_cat.to_csv('data/kmeans_categorization.csv', index=False)
+    if args.s:
+        km_obj = KmeansCategorization()
+        km_obj.kmeans_streaming(Database())
+        kmeans_cat = pd.read_csv('data/kmeans_categorization.csv').kmeans_cat
+    else:
+        data = Database().read(['thread_id', 'datetime', 'year', 'month', 'senti_avg', 'simple_heuristic_cat',
+                                'n_of_words_title', 'n_of_words_text', 'n_of_question_marks',
+                                'n_of_exclamation_marks', 'n_of_question_words', 'n_of_swear_words',
+                                'n_of_negatives', 'n_of_neg_adjectives', 'n_of_pos_adjectives'])
+        km_obj = KmeansCategorization(data, Database().version(KMEANS_FEATURES))
+        if args.p:
+            km_obj.kmeans_predict()
+        else:
+            km_obj.kmeans_main()
+        km_obj.all_data.kmeans_cat.to_csv('data/kmeans_categorization.csv', index=False)
+        Database().write(km_obj.data, 'kmeans', ['kmeans_cat'])
+        kmeans_cat = km_obj.all_data.kmeans_cat
 
     # for i in range(0,6):
     #   print(km_obj.all_data[km_obj.all_data.labels == i].groupby('simple_heuristic_cat').count())
 
     # Fit Zipf's law
-    fig = ZipfsLaw(km_obj.all_data.kmeans_cat).fit_zipfs_law()
+    fig = ZipfsLaw(kmeans_cat).fit_zipfs_law()
     fig.savefig('zipf_kmeans.png', format="png")
 
     # Calculate category transitions
-    CategoryTransitions(km_obj.all_data.kmeans_cat, 'data/kmeans_transitions.csv').get_transitions()
+    CategoryTransitions(kmeans_cat, 'data/kmeans_transitions.csv').get_transitions()
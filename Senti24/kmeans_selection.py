@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from time import time
+from multiprocessing import Pool
+from matplotlib.figure import Figure
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+try:
+    from Senti24.storage import Database
+    from Senti24.kmeans_categorization import KmeansCategorization, KMEANS_FEATURES, in_sorted
+except:
+    from storage import Database
+    from kmeans_categorization import KmeansCategorization, KMEANS_FEATURES, in_sorted
+
+"""
+Choosing the number of clusters (and the features) for the K-means categorization.
+Like the K-means categorization, only the threads with ids are used. Every candidate is fitted in its own process,
+and scored by its inertia (the elbow method) and by silhouette scores of several subsamples, which are stratified
+by cluster so that small clusters are represented too.
+Results are cached per version of the database and of the ids
+"""
+
+# Standardized features of a selection process
+worker_data = None
+
+
+def init_selection_worker(data: np.ndarray, single_thread: bool = False):
+    """
+    Stores the standardized features inside a selection process
+    :param data: Standardized features
+    :param single_thread: Limit K-means to one thread, when the candidates run side by side in processes
+    :return: Nothing
+    """
+    global worker_data
+    worker_data = data
+    if single_thread:
+        threadpool_limits(1)
+
+
+def evaluate_candidate(candidate) -> dict:
+    """
+    Fits K-means for one candidate and scores it
+    :param candidate: (subset name, feature indexes, k, silhouette sample size, number of samples)
+    :return: Inertia, and the mean silhouette score with its 95% confidence interval
+    """
+    subset, indexes, k, sample_size, n_samples = candidate
+    data = worker_data[:, indexes]
+    km = KMeans(n_clusters=k, random_state=10, n_init=3).fit(data)
+    scores = [silhouette_score(data[rows], km.labels_[rows])
+              for rows in stratified_samples(km.labels_, sample_size, n_samples)]
+    margin = 1.96 * np.std(scores, ddof=1) / np.sqrt(n_samples) if n_samples > 1 else 0.0
+    return {'subset': subset, 'k': k, 'inertia': float(km.inertia_), 'silhouette': float(np.mean(scores)),
+            'silhouette_low': float(np.mean(scores) - margin), 'silhouette_high': float(np.mean(scores) + margin)}
+
+
+def stratified_samples(labels: np.ndarray, sample_size: int, n_samples: int) -> [np.ndarray]:
+    """
+    Draws subsamples that keep the share of each cluster
+    :param labels: Cluster of each row
+    :param sample_size: Rows per subsample
+    :param n_samples: Number of subsamples
+    :return: Row indexes of each subsample
+    """
+    clusters = [np.flatnonzero(labels == c) for c in np.unique(labels)]
+    samples = []
+    for i in range(n_samples):
+        rng = np.random.default_rng(i)
+        rows = [rng.choice(c, size=min(len(c), max(1, round(sample_size * len(c) / len(labels)))), replace=False)
+                for c in clusters]
+        samples.append(np.concatenate(rows))
+    return samples
+
+
+class KmeansSelection:
+    def __init__(self, database: Database, subsets: dict = None, k_values: [int] = range(2, 10), workers: int = 1,
+                 fit_size: int = 100000, sample_size: int = 5000, n_samples: int = 5,
+                 cache_file: str = 'data/kmeans_selection.json', ids: np.ndarray = None):
+        """
+        :param database: Database with the sentiment scores and the features of the simple heuristic
+        :param subsets: {name: [feature]} to compare, only the K-means features if None
+        :param k_values: Numbers of clusters to compare
+        :param workers: Number of processes
+        :param fit_size: Number of threads sampled for fitting, all if None
+        :param sample_size: Number of threads in each silhouette subsample
+        :param n_samples: Number of silhouette subsamples
+        :param cache_file: Path to the results of earlier runs
+        :param ids: Sorted ids of the threads to use, those categorized by K-means (data/20XX_ids.txt) if None
+        """
+        self.logger = logging.getLogger('kmeans-selection')
+        self.database = database
+        self.subsets = {'all': KMEANS_FEATURES} if subsets is None else subsets
+        self.k_values = list(k_values)
+        self.workers = workers
+        self.fit_size = fit_size
+        self.sample_size = sample_size
+        self.n_samples = n_samples
+        self.cache_file = cache_file
+        self.columns = sorted({c for cols in self.subsets.values() for c in cols})
+        self.ids = KmeansCategorization().all_ids if ids is None else ids
+
+    def cache_key(self) -> str:
+        """
+        :return: Hash of the database version, the ids and the selection settings
+        """
+        settings = json.dumps([self.database.version(['thread_id', *self.columns]),
+                               hashlib.sha1(self.ids.tobytes()).hexdigest(), self.subsets, self.k_values,
+                               self.fit_size, self.sample_size, self.n_samples], sort_keys=True)
+        return hashlib.sha1(settings.encode('utf-8')).hexdigest()
+
+    def load_cache(self) -> dict:
+        """
+        :return: {cache key: results}
+        """
+        if not os.path.exists(self.cache_file):
+            return {}
+        with open(self.cache_file, 'r') as f:
+            return json.load(f)
+
+    def load_data(self) -> np.ndarray:
+        """
+        Reads the features of the threads with ids, and samples and standardizes the threads used for fitting
+        :return: Array with a column for each feature in self.columns
+        """
+        data = self.database.read(['thread_id', *self.columns])
+        data = data.loc[in_sorted(data['thread_id'].to_numpy(), self.ids), self.columns].dropna()
+        if self.fit_size is not None and len(data) > self.fit_size:
+            data = data.sample(n=self.fit_size, random_state=10)
+        return StandardScaler().fit_transform(data.to_numpy(float))
+
+    def select(self) -> pd.DataFrame:
+        """
+        Evaluates every combination of feature subset and k, or takes the results from the cache
+        :return: Inertia and silhouette scores of each candidate
+        """
+        key = self.cache_key()
+        cache = self.load_cache()
+        if key in cache:
+            self.logger.info(f'Using the cached results of {self.cache_file}')
+            return pd.DataFrame(cache[key])
+        start = time()
+        data = self.load_data()
+        candidates = [(name, [self.columns.index(c) for c in cols], k, self.sample_size, self.n_samples)
+                      for name, cols in self.subsets.items() for k in self.k_values]
+        self.logger.info(f'Evaluating {len(candidates)} candidates on {len(data)} threads')
+        if self.workers > 1:
+            with Pool(self.workers, initializer=init_selection_worker, initargs=(data, True)) as pool:
+                results = pool.map(evaluate_candidate, candidates)
+        else:
+            init_selection_worker(data)
+            results = list(map(evaluate_candidate, candidates))
+        cache[key] = results
+        with open(self.cache_file, 'w') as f:
+            json.dump(cache, f)
+        self.logger.info(f'Model selection done, took {time()-start}s')
+        return pd.DataFrame(results)
+
+    def draw_to_gui(self, results: pd.DataFrame) -> Figure:
+        """
+        Draws the inertia and the silhouette score of each k, a line for each feature subset
+        :param results: Results of select()
+        :return: The figure
+        """
+        fig = Figure(figsize=(20, 8))
+        ax1, ax2 = fig.subplots(1, 2)
+        for subset, rows in results.groupby('subset', sort=False):
+            ax1.plot(rows['k'], rows['inertia'], 'x-', label=subset)
+            ax2.errorbar(rows['k'], rows['silhouette'], capsize=4, label=subset,
+                         yerr=[rows['silhouette'] - rows['silhouette_low'],
+                               rows['silhouette_high'] - rows['silhouette']])
+        ax1.set_title('The Elbow Method to find the optimal n of clusters', fontsize=19)
+        ax1.set_xlabel('Clusters', fontsize=18)
+        ax1.set_ylabel('Inertia', fontsize=18)
+        ax2.set_title('Silhouette scores with 95% confidence intervals', fontsize=19)
+        ax2.set_xlabel('Clusters', fontsize=18)
+        ax2.set_ylabel('Silhouette score', fontsize=18)
+        ax1.legend(loc='best')
+        ax2.legend(loc='best')
+        return fig
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/kmeans-selection.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', type=int, nargs='+', default=list(range(2, 10)), help='Numbers of clusters to compare')
+    parser.add_argument('-w', type=int, default=os.cpu_count(), help='Number of processes')
+    args = parser.parse_args()
+    selection = KmeansSelection(Database(), k_values=args.k, workers=args.w)
+    results = selection.select()
+    results.to_csv('data/kmeans_selection.csv', index=False)
+    print(results.to_string(index=False))
+    selection.draw_to_gui(results).savefig('kmeans_selection.png', format='png')
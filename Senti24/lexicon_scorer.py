@@ -0,0 +1,218 @@
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from time import time
+
+"""
+Approximate SentiStrength scoring without Java. Compiles the SentiDataFI lookup tables into dictionaries
+and scores preprocessed texts (lowercased, words separated by single spaces) in process
+"""
+
+
+class LexiconScorer:
+    def __init__(self, data_loc: str):
+        self.logger = logging.getLogger('lexicon-scorer')
+        self.logger.info(f'Compiling the SentiStrength lexicon in {data_loc}')
+        start = time()
+        self.emotions, self.wildcards = self.load_emotions(os.path.join(data_loc, 'EmotionLookupTable.txt'))
+        # Lengths of the wildcard prefixes, longest first, so the most specific prefix wins
+        self.prefix_lengths = sorted({len(p) for p in self.wildcards}, reverse=True)
+        self.boosters = self.load_table(os.path.join(data_loc, 'BoosterWordList.txt'))
+        self.emoticons = self.load_table(os.path.join(data_loc, 'EmoticonLookupTable.txt'))
+        self.negations = set(self.load_wordlist(os.path.join(data_loc, 'NegatingWordList.txt')))
+        self.slang = self.load_slang(os.path.join(data_loc, 'SlangLookupTable.txt'))
+        self.idioms = self.load_idioms(os.path.join(data_loc, 'IdiomLookupTable.txt'))
+        # Scores of already seen tokens
+        self.token_scores = {}
+        self.logger.info(f'Lexicon compiled, took {time()-start}s')
+
+    def read_lines(self, file: str) -> [[str]]:
+        """
+        Reads a SentiStrength resource file. Empty lines are skipped, comments after the value are kept
+        :param file: Path to the file
+        :return: Whitespace separated fields of each line
+        """
+        if not os.path.exists(file):
+            self.logger.info(f'{file} not found, skipping it')
+            return []
+        with open(file, 'r', encoding='utf-8') as f:
+            return [line.split() for line in f if line.strip() != '']
+
+    def load_table(self, file: str) -> dict:
+        """
+        :param file: Path to a 'term <tab> value' file
+        :return: {term: value}
+        """
+        return {fields[0].lower(): int(fields[1]) for fields in self.read_lines(file) if len(fields) > 1}
+
+    def load_wordlist(self, file: str) -> [str]:
+        """
+        :param file: Path to a file with one word per line
+        :return: List of words
+        """
+        return [fields[0].lower() for fields in self.read_lines(file)]
+
+    def load_emotions(self, file: str) -> [dict, dict]:
+        """
+        Splits the emotion lookup table into exact words and wildcard prefixes (words ending with *)
+        :param file: Path to EmotionLookupTable.txt
+        :return: [{word: score}, {prefix: score}]
+        """
+        exact, wildcards = {}, {}
+        for word, score in self.load_table(file).items():
+            if word.endswith('*'):
+                wildcards[word[:-1]] = score
+            else:
+                exact[word] = score
+        return exact, wildcards
+
+    def load_slang(self, file: str) -> dict:
+        """
+        :param file: Path to SlangLookupTable.txt
+        :return: {slang: replacement}
+        """
+        return {fields[0].lower(): fields[1].lower() for fields in self.read_lines(file) if len(fields) > 1}
+
+    def load_idioms(self, file: str) -> dict:
+        """
+        Reads idioms as tuples of words. Idiom lines are 'word word ... <tab> value'
+        :param file: Path to IdiomLookupTable.txt
+        :return: {(word, word, ...): score}
+        """
+        return {tuple(w.lower() for w in fields[:-1]): int(fields[-1])
+                for fields in self.read_lines(file) if len(fields) > 1}
+
+    def token_score(self, token: str) -> int:
+        """
+        Looks up the emotion score of a token, trying the exact word first and then the wildcard prefixes
+        :param token: A single word
+        :return: Score from -5 to 5, 0 if the token carries no emotion
+        """
+        score = self.token_scores.get(token)
+        if score is not None:
+            return score
+        score = self.emoticons.get(token, self.emotions.get(token))
+        if score is None:
+            score = 0
+            for length in self.prefix_lengths:
+                if len(token) >= length and token[:length] in self.wildcards:
+                    score = self.wildcards[token[:length]]
+                    break
+        self.token_scores[token] = score
+        return score
+
+    def score_text(self, text: str) -> tuple:
+        """
+        Scores a single text like SentiStrength's dual mode: the strongest positive and negative term win.
+        Booster words strengthen (or weaken) the next emotion word. A negation right before an emotion word
+        (boosters may be in between) turns a positive word into a weaker negative one and neutralises
+        a negative word
+        :param text: Preprocessed text
+        :return: (Positive score 1...5, Negative score -1...-5)
+        """
+        tokens = [self.slang.get(t, t) for t in str(text).split()]
+        scores = [self.token_score(t) for t in tokens]
+        for idiom, score in self.idioms.items():
+            n = len(idiom)
+            for i in range(len(tokens) - n + 1):
+                if tuple(tokens[i:i + n]) == idiom:
+                    scores[i:i + n] = [score] + [0] * (n - 1)
+        pos, neg = 1, -1
+        boost, negated = 0, False
+        for token, score in zip(tokens, scores):
+            if token in self.negations:
+                negated = True
+                continue
+            if token in self.boosters and score == 0:
+                boost += self.boosters[token]
+                continue
+            if score > 0:
+                score = score + boost
+                if negated:
+                    score = -int(round(score * 0.5))
+            elif score < 0:
+                score = 0 if negated else score - boost
+            pos = max(pos, score)
+            neg = min(neg, score)
+            boost, negated = 0, False
+        return min(pos, 5), max(neg, -5)
+
+    def score_batch(self, texts) -> np.ndarray:
+        """
+        Scores a batch of texts
+        :param texts: Array of preprocessed texts
+        :return: Array of shape (n, 2) with the positive and negative score of each text
+        """
+        result = np.empty((len(texts), 2), dtype=np.int8)
+        for i, text in enumerate(texts):
+            result[i] = self.score_text(text)
+        return result
+
+    def get_sentiment(self, text: str or list) -> list:
+        """
+        Same output as PySentiStr.getSentiment(text, score='dual')
+        :param text: Text or list of texts to analyze
+        :return: [Positive score, Negative score] for each text
+        """
+        texts = [text] if isinstance(text, str) else text
+        return [tuple(int(s) for s in row) for row in self.score_batch(texts)]
+
+
+def agreement_report(approx: np.ndarray, reference: np.ndarray) -> dict:
+    """
+    Compares the scores of the lexicon scorer with the scores given by SentiStrength.jar
+    :param approx: Array of shape (n, 2) from LexiconScorer.score_batch
+    :param reference: Array of shape (n, 2) from SentiStrength
+    :return: Share of exact and off-by-one matches, and the correlation of the score sums
+    """
+    approx = np.asarray(approx, dtype=np.int16)
+    reference = np.asarray(reference, dtype=np.int16)
+    diff = np.abs(approx - reference)
+    approx_sum = approx.sum(axis=1)
+    reference_sum = reference.sum(axis=1)
+    if approx_sum.std() > 0 and reference_sum.std() > 0:
+        sum_corr = float(np.corrcoef(approx_sum, reference_sum)[0, 1])
+    else:
+        sum_corr = float('nan')
+    return {
+        'n': len(approx),
+        'pos_exact': float((diff[:, 0] == 0).mean()),
+        'neg_exact': float((diff[:, 1] == 0).mean()),
+        'both_exact': float((diff.max(axis=1) == 0).mean()),
+        'pos_within_1': float((diff[:, 0] <= 1).mean()),
+        'neg_within_1': float((diff[:, 1] <= 1).mean()),
+        'sum_exact': float((approx_sum == reference_sum).mean()),
+        'sum_correlation': sum_corr,
+    }
+
+
+if __name__ == '__main__':
+    try:
+        from Senti24.senti_score2 import SentiScore
+    except:
+        from senti_score2 import SentiScore
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/lexicon-scorer.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', type=str, help='Absolute path to SentiStrength.jar')
+    parser.add_argument('-d', type=str, help='Absolute path to SentiStrength_DataFi')
+    parser.add_argument('-n', type=int, default=10000, help='Number of sampled texts to compare')
+    args = parser.parse_args()
+    # Take a sample of titles and texts from the preprocessed data
+    data = pd.read_csv('data/data_combined_preprocessed.csv', usecols=['title', 'text'], nrows=20 * args.n)
+    sample = pd.concat([data['title'], data['text']]).sample(n=args.n, random_state=10).values
+    # Score the sample with both, and compare
+    lexicon = LexiconScorer(args.d)
+    start = time()
+    approx = lexicon.score_batch(sample)
+    logging.info(f'Lexicon scorer took {time()-start}s')
+    start = time()
+    reference = np.array(SentiScore(args.j, args.d).get_sentiment(list(sample)))
+    logging.info(f'SentiStrength.jar took {time()-start}s')
+    report = agreement_report(approx, reference)
+    logging.info(f'Agreement with SentiStrength.jar: {report}')
+    print(pd.Series(report).to_string())
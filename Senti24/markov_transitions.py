@@ -0,0 +1,161 @@
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from time import time
+
+try:
+    from Senti24.storage import Database
+    from Senti24.senti_transition import SentiTransition
+except:
+    from storage import Database
+    from senti_transition import SentiTransition
+
+"""
+Markov chain view of a sequence of sentiment classes or thread categories, in chronological order.
+Counts n-gram transitions (the previous n classes -> the next class) and k-step transitions (a class -> the class
+k threads later), turns them into probabilities, and finds the stationary distribution of the first order chain
+"""
+
+# First order transitions are saved to the files the GUI already reads
+FIRST_ORDER_FILES = {'senti_avg': 'data/sentiment-transitions.csv',
+                     'simple_heuristic_cat': 'data/simple_transitions.csv',
+                     'kmeans_cat': 'data/kmeans_transitions.csv'}
+
+
+def sentiment_codes(values) -> (np.ndarray, [str]):
+    """
+    :param values: Sentiment scores
+    :return: Class code of each score, and the classes of SentiTransition
+    """
+    st = SentiTransition()
+    return st.get_classes(values), st.classes
+
+
+def category_codes(categories) -> (np.ndarray, list):
+    """
+    :param categories: Category of each thread
+    :return: Code of each category, and the categories in the order of their first appearance
+    """
+    codes, uniques = pd.factorize(categories, sort=False, use_na_sentinel=False)
+    return codes, list(np.asarray(uniques, dtype=object))
+
+
+class MarkovTransitions:
+    def __init__(self, codes: np.ndarray, classes: list):
+        self.logger = logging.getLogger('markov-transitions')
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.classes = classes
+
+    def ngram_counts(self, order: int = 1) -> np.ndarray:
+        """
+        Counts how often each sequence of order classes is followed by each class
+        :param order: Number of previous classes
+        :return: Array with order + 1 axes of length K, the last axis is the next class
+        """
+        k = len(self.classes)
+        n = len(self.codes) - order
+        if n <= 0:
+            return np.zeros((k,) * (order + 1), dtype=np.int64)
+        # Every window of order + 1 consecutive codes is read as one number in base K
+        index = np.zeros(n, dtype=np.int64)
+        for i in range(order + 1):
+            index = index * k + self.codes[i:i + n]
+        return np.bincount(index, minlength=k ** (order + 1)).reshape((k,) * (order + 1))
+
+    def step_counts(self, steps: int = 1) -> np.ndarray:
+        """
+        Counts how often a class is followed by each class the given number of threads later
+        :param steps: Distance between the threads
+        :return: K x K array, rows are the earlier classes
+        """
+        k = len(self.classes)
+        if len(self.codes) <= steps:
+            return np.zeros((k, k), dtype=np.int64)
+        index = self.codes[:-steps] * k + self.codes[steps:]
+        return np.bincount(index, minlength=k * k).reshape(k, k)
+
+    def probabilities(self, counts: np.ndarray) -> np.ndarray:
+        """
+        :param counts: Result of ngram_counts or step_counts
+        :return: Probabilities of the next class, rows without transitions are all zero
+        """
+        totals = counts.sum(axis=-1, keepdims=True)
+        return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+    def stationary_distribution(self) -> pd.Series:
+        """
+        Solves pi = pi * P for the first order transition probabilities P
+        :return: Long run share of each class
+        """
+        p = self.probabilities(self.ngram_counts(1))
+        k = len(self.classes)
+        # pi (P - I) = 0 with the shares summing to one, solved in the least squares sense
+        a = np.vstack([p.T - np.eye(k), np.ones(k)])
+        b = np.append(np.zeros(k), 1.0)
+        pi = np.linalg.lstsq(a, b, rcond=None)[0]
+        return pd.Series(pi, index=self.classes, name='probability')
+
+    def table(self, counts: np.ndarray) -> pd.DataFrame:
+        """
+        Flattens transition counts into one row per transition
+        :param counts: Result of ngram_counts or step_counts
+        :return: Columns from_1 ... from_n, to, count and probability
+        """
+        order = counts.ndim - 1
+        labels = np.array(self.classes, dtype=object)
+        index = np.indices(counts.shape).reshape(counts.ndim, -1)
+        df = pd.DataFrame({f'from_{i+1}': labels[index[i]] for i in range(order)})
+        df['to'] = labels[index[-1]]
+        df['count'] = counts.reshape(-1)
+        df['probability'] = self.probabilities(counts).reshape(-1)
+        return df
+
+    def first_order_table(self) -> pd.DataFrame:
+        """
+        :return: K x K first order transition counts, in the layout of the existing transition files
+        """
+        return pd.DataFrame(self.ngram_counts(1), index=self.classes, columns=self.classes)
+
+    def save(self, column: str, orders: [int] = (1, 2, 3), steps: [int] = (2, 3)):
+        """
+        Saves the transitions of the given orders and steps, and the stationary distribution.
+        First order transitions go to the file the GUI reads (see FIRST_ORDER_FILES), the rest to
+        data/<column>-order<n>.csv and data/<column>-step<k>.csv
+        :param column: Column the classes come from
+        :param orders: N-gram orders to save
+        :param steps: Step distances to save
+        :return: Nothing
+        """
+        start = time()
+        for order in orders:
+            if order == 1 and column in FIRST_ORDER_FILES:
+                self.first_order_table().to_csv(FIRST_ORDER_FILES[column])
+            else:
+                self.table(self.ngram_counts(order)).to_csv(f'data/{column}-order{order}.csv', index=False)
+        for step in steps:
+            self.table(self.step_counts(step)).to_csv(f'data/{column}-step{step}.csv', index=False)
+        self.stationary_distribution().to_csv(f'data/{column}-stationary.csv', index_label='class')
+        self.logger.info(f'Transitions of {column} saved, took {time()-start}s')
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/markov-transitions.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', type=str, default='senti_avg',
+                        help='Column to analyze: senti_avg, simple_heuristic_cat or kmeans_cat')
+    parser.add_argument('-o', type=int, nargs='+', default=[1, 2, 3], help='N-gram orders')
+    parser.add_argument('-k', type=int, nargs='+', default=[2, 3], help='Step distances')
+    args = parser.parse_args()
+    values = Database().read([args.c])[args.c]
+    if args.c == 'senti_avg':
+        codes, classes = sentiment_codes(values)
+    else:
+        # Threads without a category (e.g. not among the K-means ids) are left out of the sequence
+        codes, classes = category_codes(values.dropna())
+    markov = MarkovTransitions(codes, classes)
+    markov.save(args.c, args.o, args.k)
+    print(markov.stationary_distribution().to_string())
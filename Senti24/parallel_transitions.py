@@ -0,0 +1,138 @@
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from time import time
+from multiprocessing import Pool
+
+try:
+    from Senti24.storage import Database
+    from Senti24.senti_transition import SentiTransition
+    from Senti24.markov_transitions import FIRST_ORDER_FILES
+except:
+    from storage import Database
+    from senti_transition import SentiTransition
+    from markov_transitions import FIRST_ORDER_FILES
+
+"""
+Transition counting one database partition at a time, in parallel processes, so the whole column never has to be
+in memory. Each worker counts the transitions inside its partition and reports the first and last class of it,
+and the reducer adds the transitions between neighbouring partitions. The result is identical to
+SentiTransition.calculate_transitions and CategoryTransitions.transition_matrix on the whole column
+"""
+
+# Database, column, and whether to leave out threads without a category, inside a counting process
+worker_database = None
+worker_column = None
+worker_dropna = False
+
+
+def init_transition_worker(root: str, column: str, dropna: bool = False):
+    """
+    Stores the settings of the count inside a counting process
+    :param root: Path to the database
+    :param column: Column to count the transitions of
+    :param dropna: Leave out threads without a category
+    :return: Nothing
+    """
+    global worker_database, worker_column, worker_dropna
+    worker_database = Database(root)
+    worker_column = column
+    worker_dropna = dropna
+
+
+def count_partition(partition: (int, int)):
+    """
+    Counts the transitions inside one partition
+    :param partition: (year, month)
+    :return: (K x K counts, classes, first class code, last class code) with the classes of this partition only,
+             or None if the partition has no threads
+    """
+    year, month = partition
+    values = worker_database.read_partition(year, month, [worker_column])[worker_column]
+    if worker_dropna:
+        values = values.dropna()
+    if len(values) == 0:
+        return None
+    if worker_column == 'senti_avg':
+        st = SentiTransition()
+        codes, classes = st.get_classes(values.values), st.classes
+    else:
+        codes, classes = pd.factorize(values, sort=False, use_na_sentinel=False)
+    k = len(classes)
+    counts = np.bincount(codes[:-1] * k + codes[1:], minlength=k * k).reshape(k, k)
+    return counts, list(classes), int(codes[0]), int(codes[-1])
+
+
+class ParallelTransitions:
+    def __init__(self, database: Database, column: str, workers: int = 1, dropna: bool = False):
+        """
+        :param database: Database with the column
+        :param column: senti_avg, or a column of categories
+        :param workers: Number of processes
+        :param dropna: Leave out threads without a category, e.g. the threads K-means did not categorize
+        """
+        self.logger = logging.getLogger('parallel-transitions')
+        self.database = database
+        self.column = column
+        self.workers = workers
+        self.dropna = dropna
+
+    def reduce(self, results: list) -> pd.DataFrame:
+        """
+        Sums the counts of the partitions, and adds the transition from the last thread of each partition to the
+        first thread of the next one
+        :param results: Results of count_partition in chronological order
+        :return: K x K table of transition counts, categories are in the order of their first appearance
+        """
+        results = [r for r in results if r is not None]
+        # Partition classes -> classes of the whole column, in the order the partitions first show them
+        classes = pd.Index([])
+        for _, partition_classes, _, _ in results:
+            classes = classes.append(pd.Index(partition_classes).difference(classes, sort=False))
+        total = np.zeros((len(classes), len(classes)), dtype=np.int64)
+        last = None
+        for counts, partition_classes, first_code, last_code in results:
+            lookup = classes.get_indexer(pd.Index(partition_classes))
+            total[np.ix_(lookup, lookup)] += counts
+            if last is not None:
+                total[last, lookup[first_code]] += 1
+            last = lookup[last_code]
+        labels = np.asarray(classes, dtype=object)
+        return pd.DataFrame(total, index=labels, columns=labels)
+
+    def calculate(self) -> pd.DataFrame:
+        """
+        Counts the transitions of every partition, in parallel if there are several workers
+        :return: K x K table of transition counts, see reduce
+        """
+        self.logger.info(f'Counting the transitions of {self.column} with {self.workers} processes')
+        start = time()
+        partitions = self.database.partitions()
+        initargs = (self.database.root, self.column, self.dropna)
+        if self.workers > 1:
+            with Pool(self.workers, initializer=init_transition_worker, initargs=initargs) as pool:
+                results = pool.map(count_partition, partitions)
+        else:
+            init_transition_worker(*initargs)
+            results = list(map(count_partition, partitions))
+        table = self.reduce(results)
+        self.logger.info(f'Transitions of {len(partitions)} partitions counted, took {time()-start}s')
+        return table
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/parallel-transitions.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', type=str, default='senti_avg',
+                        help='Column to analyze: senti_avg, simple_heuristic_cat or kmeans_cat')
+    parser.add_argument('-w', type=int, default=os.cpu_count(), help='Number of processes')
+    parser.add_argument('-d', action='store_true', help='Leave out threads without a category')
+    args = parser.parse_args()
+    table = ParallelTransitions(Database(), args.c, args.w, args.d).calculate()
+    table.to_csv(FIRST_ORDER_FILES.get(args.c, f'data/{args.c}-transitions.csv'))
+    print(table.to_string())
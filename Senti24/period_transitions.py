@@ -0,0 +1,151 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from time import time
+
+try:
+    from Senti24.storage import Database
+    from Senti24.markov_transitions import sentiment_codes, category_codes
+except:
+    from storage import Database
+    from markov_transitions import sentiment_codes, category_codes
+
+"""
+Transition counts of each month, for the sentiment classes and both category columns. The database is read once,
+and only transitions between consecutive threads of the same month are counted, so the months add up to the
+transitions of a year or of the whole data minus the pairs that cross a month boundary.
+The result is a (month x from x to) count cube for each column, saved to data/period_transitions.npz
+"""
+
+# Columns the transitions are counted for. Sentiment transitions use the classes of SentiTransition,
+# categories are in the order of their first appearance
+PERIOD_COLUMNS = ['senti_avg', 'simple_heuristic_cat', 'kmeans_cat']
+
+
+class PeriodTransitions:
+    def __init__(self, database: Database, file: str = 'data/period_transitions.npz'):
+        self.logger = logging.getLogger('period-transitions')
+        self.database = database
+        self.file = file
+        # [(year, month)], {column: classes}, {column: array of shape (periods, K, K)}
+        self.periods = []
+        self.classes = {}
+        self.counts = {}
+
+    def count_cube(self, periods: np.ndarray, codes: np.ndarray, k: int) -> np.ndarray:
+        """
+        Counts the transitions of all periods with one bincount, the period code and the transition
+        are read as one number
+        :param periods: Period code of each thread, in chronological order
+        :param codes: Class code of each thread
+        :param k: Number of classes
+        :return: Array of shape (periods, K, K)
+        """
+        n_periods = len(self.periods)
+        # Only pairs of consecutive threads of the same period
+        same = periods[:-1] == periods[1:]
+        index = (periods[:-1][same] * k + codes[:-1][same]) * k + codes[1:][same]
+        return np.bincount(index, minlength=n_periods * k * k).reshape(n_periods, k, k)
+
+    def calculate(self):
+        """
+        Counts the transitions of every period in one pass over the database. Threads without a category are left
+        out of the category transitions
+        :return: Nothing
+        """
+        self.logger.info('Counting transitions by month')
+        start = time()
+        df = self.database.read(['year', 'month'] + PERIOD_COLUMNS)
+        periods, uniques = pd.factorize(df['year'].astype(np.int64) * 100 + df['month'].astype(np.int64), sort=True)
+        self.periods = [(int(p // 100), int(p % 100)) for p in uniques]
+        periods = periods.astype(np.int64)
+        for col in PERIOD_COLUMNS:
+            if col not in df:
+                self.classes[col] = []
+                self.counts[col] = np.zeros((len(self.periods), 0, 0), dtype=np.int64)
+                continue
+            if col == 'senti_avg':
+                codes, classes = sentiment_codes(df[col].values)
+                rows = periods
+            else:
+                categorized = df[col].notna().values
+                codes, classes = category_codes(df[col][categorized])
+                rows = periods[categorized]
+            self.classes[col] = list(classes)
+            self.counts[col] = self.count_cube(rows, np.asarray(codes, dtype=np.int64), len(classes))
+        self.logger.info(f'Transitions of {len(self.periods)} months counted, took {time()-start}s')
+
+    def save(self):
+        """
+        Saves the count cubes with the version of the database they were counted from
+        :return: Nothing
+        """
+        arrays = {'periods': np.array(self.periods, dtype=np.int16).reshape(-1, 2),
+                  'version': np.array(self.database.version(PERIOD_COLUMNS))}
+        for col in PERIOD_COLUMNS:
+            arrays[f'{col}_classes'] = np.array(self.classes[col], dtype=str)
+            arrays[f'{col}_counts'] = self.counts[col].astype(np.int32)
+        with open(self.file + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(self.file + '.tmp', self.file)
+        self.logger.info(f'Saved to {self.file}')
+
+    def load(self) -> bool:
+        """
+        Loads the saved count cubes, if they were counted from the current database
+        :return: True if loaded
+        """
+        if not os.path.exists(self.file):
+            return False
+        with np.load(self.file) as saved:
+            if str(saved['version']) != self.database.version(PERIOD_COLUMNS):
+                return False
+            self.periods = [tuple(p) for p in saved['periods'].tolist()]
+            for col in PERIOD_COLUMNS:
+                self.classes[col] = saved[f'{col}_classes'].tolist()
+                self.counts[col] = saved[f'{col}_counts'].astype(np.int64)
+        return True
+
+    def load_or_calculate(self):
+        """
+        Loads the saved count cubes, or counts and saves them again if the database has changed
+        :return: Nothing
+        """
+        if not self.load():
+            self.calculate()
+            self.save()
+
+    def years(self) -> [int]:
+        """
+        :return: Years with transitions
+        """
+        return sorted({year for year, _ in self.periods})
+
+    def query(self, column: str, years: [int] = None, months: [int] = None) -> pd.DataFrame:
+        """
+        Sums the transitions of the selected periods
+        :param column: One of PERIOD_COLUMNS
+        :param years: Only these years, all if None
+        :param months: Only these months, all if None
+        :return: K x K table of transition counts, rows are the classes transitioned from
+        """
+        periods = np.array(self.periods, dtype=np.int64).reshape(-1, 2)
+        selected = np.ones(len(periods), dtype=bool)
+        if years is not None:
+            selected &= np.isin(periods[:, 0], years)
+        if months is not None:
+            selected &= np.isin(periods[:, 1], months)
+        counts = self.counts[column][selected].sum(axis=0)
+        return pd.DataFrame(counts, index=self.classes[column], columns=self.classes[column])
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/period-transitions.log', filemode='w')
+    pt = PeriodTransitions(Database())
+    pt.calculate()
+    pt.save()
+    for col in PERIOD_COLUMNS:
+        print(f'{col}:\n{pt.query(col).to_string()}\n')
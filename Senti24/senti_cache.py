@@ -0,0 +1,97 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+"""
+On-disk cache of sentiment scores. Entries are keyed by a hash of the normalized text and the lexicon version,
+so the same title or text is only scored once across runs. The least recently used entries are evicted
+when the cache grows past its limit
+"""
+
+
+def lexicon_version(jar_loc: str, data_loc: str, backend: str) -> str:
+    """
+    Fingerprints everything that affects the scores: the backend, SentiStrength.jar and the SentiDataFI files
+    :param jar_loc: Path to SentiStrength.jar
+    :param data_loc: Path to SentiDataFI
+    :param backend: Sentiment backend used by SentiScore
+    :return: Version string
+    """
+    h = hashlib.sha1(backend.encode('utf-8'))
+    files = [jar_loc] if backend != 'lexicon' else []
+    if os.path.isdir(data_loc):
+        files.extend(os.path.join(data_loc, f) for f in sorted(os.listdir(data_loc)))
+    for file in files:
+        if os.path.isfile(file):
+            h.update(os.path.basename(file).encode('utf-8'))
+            with open(file, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class SentiCache:
+    def __init__(self, path: str = 'data/senti-cache.sqlite', version: str = '', max_entries: int = 5000000):
+        self.logger = logging.getLogger('senti-cache')
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS scores '
+                          '(key BLOB PRIMARY KEY, pos INTEGER, neg INTEGER, used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS scores_used ON scores (used)')
+        self.conn.commit()
+
+    def key(self, text) -> bytes:
+        """
+        :param text: Title or text
+        :return: Hash of the lexicon version and the text with whitespace normalized
+        """
+        normalized = ' '.join(str(text).split())
+        return hashlib.sha1(f'{self.version}\0{normalized}'.encode('utf-8')).digest()
+
+    def get_many(self, keys: [bytes]) -> dict:
+        """
+        Looks up cached scores and marks the found entries as used
+        :param keys: Keys from SentiCache.key
+        :return: {key: (positive, negative)} for the keys found in the cache
+        """
+        found = {}
+        # SQLite limits the number of parameters in one query
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            rows = self.conn.execute(f'SELECT key, pos, neg FROM scores WHERE key IN ({",".join("?" * len(batch))})',
+                                     batch).fetchall()
+            found.update((k, (pos, neg)) for k, pos, neg in rows)
+        now = time.time()
+        self.conn.executemany('UPDATE scores SET used = ? WHERE key = ?', [(now, k) for k in found])
+        self.conn.commit()
+        return found
+
+    def put_many(self, items: dict):
+        """
+        Adds scores to the cache, and evicts the least recently used entries if the cache is full
+        :param items: {key: (positive, negative)}
+        :return: Nothing
+        """
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)',
+                              [(k, int(s[0]), int(s[1]), now) for k, s in items.items()])
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into max_entries
+        :return: Nothing
+        """
+        size = self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+        if size > self.max_entries:
+            self.logger.info(f'Evicting {size-self.max_entries} entries from {self.path}')
+            self.conn.execute('DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY used LIMIT ?)',
+                              (size - self.max_entries,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -3,12 +3,24 @@ import logging
 import pandas as pd
 from scipy.stats import pearsonr
 
+try:
+    from Senti24.storage import Database
+    from Senti24.senti_rollup import SentiRollup
+except:
+    from storage import Database
+    from senti_rollup import SentiRollup
+
 
 class SentiCorrelation:
-    def __init__(self, db: pd.DataFrame):
+    def __init__(self, db: pd.DataFrame = None, year_averages: dict = None):
+        """
+        :param db: [year, senti_avg] of each thread, not needed if year_averages are given
+        :param year_averages: {year: average sentiment}, e.g. from SentiRollup.stats(level='year')
+        """
         self.logger = logging.getLogger('senti-correlation')
         #self.df = self.read_csv()
         self.db = db
+        self.year_averages = year_averages
 
         # Happy Planet Index well-being score for 2009, 2012, and 2016
         # -> Have to use well-being instead of total HPI score, since in 2016 they changed how the score is calculated
@@ -37,6 +49,15 @@ class SentiCorrelation:
         averages = data[data['year'] == year]['senti_avg'].values
         return sum(averages)/len(averages)
 
+    def year_average(self, year: int) -> float:
+        """
+        :param year: Year
+        :return: Average sentiment of the year, from year_averages if given
+        """
+        if self.year_averages is not None:
+            return self.year_averages[year]
+        return self.get_year_average(self.db, year)
+
     def correlation(self) -> [str, float, int]:
         """
         Calculates the correlation between sentiment data and predefined index scores
@@ -44,9 +65,9 @@ class SentiCorrelation:
         """
         self.logger.info('Starting correlation calculation')
         start = time.time()
-        hpi_year_averages = [self.get_year_average(self.db, year) for year in [2009, 2012, 2016]]
-        better_life_averages = [self.get_year_average(self.db, year) for year in [2013, 2014, 2015, 2016, 2017]]
-        world_happiness_averages = [self.get_year_average(self.db, year) for year in [2015, 2016, 2017]]
+        hpi_year_averages = [self.year_average(year) for year in [2009, 2012, 2016]]
+        better_life_averages = [self.year_average(year) for year in [2013, 2014, 2015, 2016, 2017]]
+        world_happiness_averages = [self.year_average(year) for year in [2015, 2016, 2017]]
         result = []
 
         # HPI
@@ -84,5 +105,5 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
                         datefmt='%H:%M:%S', filename='logs/correlation.log', filemode='w')
 
-    data = pd.read_csv('data/database.csv')[['year', 'senti_avg']]
-    SentiCorrelation(data).correlation()
+    stats = SentiRollup(Database()).stats('senti_avg', 'year')
+    SentiCorrelation(year_averages=dict(zip(stats['year'], stats['avg']))).correlation()
@@ -1,9 +1,15 @@
 import time
 import logging
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 
+try:
+    from Senti24.storage import Database
+except:
+    from storage import Database
+
 
 class SentiPlot:
     def __init__(self):
@@ -17,24 +23,16 @@ class SentiPlot:
         """
         return sum(senti_sum)/len(senti_sum)
 
-    def draw(self, data: 'DataFrame', save: bool = False):
+    def draw(self, data: pd.DataFrame, save: bool = False):
         """
         Draws a plot of the average sentiment for each year/month in the given data
         :param data: [year, month, sentiment]
         """
-        self.logger.info('Calculating averages for each month')
-        start = time.time()
-        obs = {}  # Sentiment observations
-        # Extract unique years
-        for year in data['year'].unique():
-            # Calculate average sentiment for each month
-            for month in data[data['year'] == year]['month'].unique():
-                avgs = data[(data['year'] == year) & (data['month'] == month)]['senti_avg'].values
-                obs[f'{year}-{month:02d}'] = sum(avgs)/len(avgs)
-        self.logger.info(f'Averages calculated, took {time.time()-start}s')
+        stats = self.monthly_stats(data)
+        obs = self.calculate_averages(data, stats)  # Sentiment observations
         # Save the result
         if save:
-            self.save_stats(obs)
+            self.save_stats(stats)
         self.logger.info('Drawing the plot')
         # Creating the figure
         fig = plt.figure()
@@ -55,19 +53,62 @@ class SentiPlot:
         plt.show()
         self.logger.info('Drawing complete')
 
-    def calculate_averages(self, db: pd.DataFrame) -> dict:
-        # Extract unique years
-        obs = {}
-        for year in db['year'].unique():
-            # Calculate average sentiment for each month
-            for month in db[db['year'] == year]['month'].unique():
-                avgs = db[(db['year'] == year) & (db['month'] == month)]['senti_avg'].values
-                obs[f'{year}-{month:02d}'] = sum(avgs) / len(avgs)
-        return obs
+    def monthly_stats(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aggregates the sentiment of each year/month in one pass. Years are in the order of their first appearance,
+        and the months of a year in the order of their first appearance within it. Sums are accumulated in row order
+        like sum(), so the averages are the same as sum(values)/len(values)
+        :param data: [year, month, senti_avg]
+        :return: year, month, count, sum, avg, var, min and max of each month
+        """
+        self.logger.info('Calculating statistics for each month')
+        start = time.time()
+        year_codes, years = pd.factorize(data['year'], sort=False)
+        # Year code and month as one key, in the order each month first appears
+        codes, keys = pd.factorize(year_codes.astype(np.int64) * 100 + data['month'].to_numpy(np.int64), sort=False)
+        # Months grouped by year, keeping the order of their first appearance
+        order = np.argsort(keys // 100, kind='stable')
+        keys = keys[order]
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        codes = rank[codes]
+        n = len(order)
+        values = data['senti_avg'].to_numpy(float)
+        count = np.bincount(codes, minlength=n)
+        total = np.bincount(codes, weights=values, minlength=n)
+        avg = total / count
+        squares = np.bincount(codes, weights=(values - avg[codes]) ** 2, minlength=n)
+        var = np.divide(squares, count - 1, out=np.full(n, np.nan), where=count > 1)
+        low = np.full(n, np.inf)
+        high = np.full(n, -np.inf)
+        # A missing score makes the statistics of its month missing, like the average
+        with np.errstate(invalid='ignore'):
+            np.minimum.at(low, codes, values)
+            np.maximum.at(high, codes, values)
+        stats = pd.DataFrame({'year': np.asarray(years)[keys // 100], 'month': keys % 100,
+                              'count': count, 'sum': total, 'avg': avg, 'var': var, 'min': low, 'max': high})
+        self.logger.info(f'Statistics of {n} months calculated, took {time.time()-start}s')
+        return stats
 
-    def draw_to_gui(self, db: pd.DataFrame):
+    def calculate_averages(self, db: pd.DataFrame, stats: pd.DataFrame = None) -> dict:
+        """
+        :param db: [year, month, senti_avg]
+        :param stats: Result of monthly_stats, calculated from db if None
+        :return: {'YYYY-MM': average sentiment}
+        """
+        if stats is None:
+            stats = self.monthly_stats(db)
+        return {f'{year}-{month:02d}': avg for year, month, avg in
+                zip(stats['year'].tolist(), stats['month'].tolist(), stats['avg'].tolist())}
+
+    def draw_to_gui(self, db: pd.DataFrame = None, stats: pd.DataFrame = None):
+        """
+        :param db: [year, month, senti_avg], not needed if stats are given
+        :param stats: Monthly statistics with year, month and avg, e.g. from SentiRollup.stats
+        :return: The figure
+        """
         self.logger.info('Drawing figure for the GUI')
-        obs = self.calculate_averages(db)  # Sentiment observations
+        obs = self.calculate_averages(db, stats)  # Sentiment observations
         fig = Figure(dpi=300)
         axis = fig.add_subplot(1, 1, 1)
         obs_range = range(len(list(obs.keys())))
@@ -83,23 +124,22 @@ class SentiPlot:
         self.logger.info('Done drawing')
         return fig
 
-    def save_stats(self, stats: dict):
+    def save_stats(self, stats: pd.DataFrame):
+        """
+        Saves the statistics of each month to senti_avg.csv
+        :param stats: Result of monthly_stats
+        :return: Nothing
+        """
         self.logger.info('Saving stats')
         start = time.time()
-        keys = stats.keys()
-        df = pd.DataFrame(columns=['year', 'month', 'avg'])
-        for key in keys:
-            year, month = key.split('-')
-            df = df.append({'year': year, 'month': month, 'avg': stats[key]}, ignore_index=True)
-        df.to_csv('senti_avg.csv')
+        stats.to_csv('senti_avg.csv')
         self.logger.info(f'Stats saved, took {time.time()-start}s')
 
-
 if __name__ == '__main__':
     # Set logging format
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
     # Read the sentiment data
-    data = pd.read_csv('data/database.csv')
+    data = Database().read(['year', 'month', 'senti_avg'])
     # Draw the monthly plot
-    SentiPlot().draw(data[['year', 'month', 'senti_avg']], True)
+    SentiPlot().draw(data, True)
 
@@ -0,0 +1,146 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from time import time
+
+try:
+    from Senti24.storage import Database
+except:
+    from storage import Database
+
+"""
+Rollup of the sentiment scores: the count, sum and sum of squares of each score for every day, saved to
+data/senti_rollup.csv. Monthly and yearly averages and variances are sums over its rows, so plots and correlations
+don't have to read the scores of every thread. The scores are halves of integers, so the sums are exact and the
+averages are the same as those calculated from the threads.
+New threads are added to it as they are scored, and it is rebuilt from the database whenever the database has been
+written without updating it (the version of the database it matches is kept in data/senti_rollup.json)
+"""
+
+# Scores kept in the rollup
+ROLLUP_COLUMNS = ['senti_avg', 'title_s_sum', 'text_s_sum']
+LEVELS = {'year': ['year'], 'month': ['year', 'month'], 'day': ['year', 'month', 'day']}
+
+
+class SentiRollup:
+    def __init__(self, database: Database, file: str = None):
+        """
+        :param database: Database with the sentiment scores
+        :param file: Path to the rollup, senti_rollup.csv next to the database (data/senti_rollup.csv) if None
+        """
+        self.logger = logging.getLogger('senti-rollup')
+        self.database = database
+        self.file = os.path.join(os.path.dirname(database.root), 'senti_rollup.csv') if file is None else file
+        self.version_file = os.path.splitext(self.file)[0] + '.json'
+
+    def aggregate(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Rolls scored threads up by day
+        :param data: year, month, datetime and the scores of each thread
+        :return: year, month, day, threads, and <score>_count, <score>_sum and <score>_sumsq of each score
+        """
+        days = pd.to_datetime(data['datetime'], errors='coerce').dt.day.fillna(0)
+        df = pd.DataFrame({'year': data['year'].to_numpy(np.int64), 'month': data['month'].to_numpy(np.int64),
+                           'day': days.to_numpy(np.int64), 'threads': 1})
+        for col in ROLLUP_COLUMNS:
+            values = data[col].to_numpy(float) if col in data else np.full(len(data), np.nan)
+            df[f'{col}_count'] = ~np.isnan(values)
+            df[f'{col}_sum'] = np.nan_to_num(values)
+            df[f'{col}_sumsq'] = np.nan_to_num(values) ** 2
+        return df.groupby(LEVELS['day'], as_index=False).sum()
+
+    def save(self, rollup: pd.DataFrame, version: str = None):
+        """
+        Atomically writes the rollup, and then the version of the database it matches
+        :param rollup: Result of aggregate
+        :param version: Version of the database, the current one if None
+        :return: Nothing
+        """
+        version = self.database.version(ROLLUP_COLUMNS) if version is None else version
+        rollup.to_csv(self.file + '.tmp', index=False)
+        os.replace(self.file + '.tmp', self.file)
+        with open(self.version_file + '.tmp', 'w') as f:
+            json.dump({'version': version}, f)
+        os.replace(self.version_file + '.tmp', self.version_file)
+
+    def saved_version(self) -> str:
+        """
+        :return: Version of the database the saved rollup matches, None if there is no rollup
+        """
+        if not os.path.exists(self.file) or not os.path.exists(self.version_file):
+            return None
+        with open(self.version_file, 'r') as f:
+            return json.load(f).get('version')
+
+    def rebuild(self) -> pd.DataFrame:
+        """
+        Rolls up the whole database again, one partition at a time
+        :return: The rollup
+        """
+        self.logger.info(f'Rebuilding {self.file}')
+        start = time()
+        # Taken before reading, so a write during the rebuild makes the rollup outdated rather than wrongly current
+        version = self.database.version(ROLLUP_COLUMNS)
+        columns = ['year', 'month', 'datetime'] + ROLLUP_COLUMNS
+        frames = [self.aggregate(df) for _, _, df in self.database.iter_partitions(columns)]
+        rollup = pd.concat(frames, ignore_index=True) if len(frames) > 0 else self.aggregate(
+            pd.DataFrame(columns=columns))
+        self.save(rollup, version)
+        self.logger.info(f'Rollup of {rollup["threads"].sum()} threads saved, took {time()-start}s')
+        return rollup
+
+    def add(self, data: pd.DataFrame):
+        """
+        Adds newly scored threads to the rollup, after they have been appended to the database
+        :param data: year, month, datetime and the scores of the new threads
+        :return: Nothing
+        """
+        rollup = self.aggregate(data)
+        if os.path.exists(self.file):
+            rollup = pd.concat([pd.read_csv(self.file), rollup], ignore_index=True)
+            rollup = rollup.groupby(LEVELS['day'], as_index=False).sum()
+        self.save(rollup)
+
+    def load(self) -> pd.DataFrame:
+        """
+        Reads the rollup, or rebuilds it if it is missing or the database has been written since it was saved
+        :return: The rollup by day
+        """
+        saved = self.saved_version()
+        if saved is not None and saved == self.database.version(ROLLUP_COLUMNS):
+            return pd.read_csv(self.file)
+        if saved is not None:
+            self.logger.info(f'{self.file} does not match the database')
+        return self.rebuild()
+
+    def stats(self, column: str = 'senti_avg', level: str = 'month') -> pd.DataFrame:
+        """
+        Statistics of a score by year, month or day, in chronological order
+        :param column: One of ROLLUP_COLUMNS
+        :param level: year, month or day
+        :return: The keys of the level, count, sum, avg and var (with ddof=1) of the score
+        """
+        keys = LEVELS[level]
+        rollup = self.load().groupby(keys, as_index=False)[[f'{column}_count', f'{column}_sum',
+                                                            f'{column}_sumsq']].sum()
+        count = rollup[f'{column}_count'].to_numpy(float)
+        total = rollup[f'{column}_sum'].to_numpy(float)
+        squares = rollup[f'{column}_sumsq'].to_numpy(float)
+        stats = rollup[keys].copy()
+        stats['count'] = rollup[f'{column}_count']
+        stats['sum'] = total
+        stats['avg'] = np.divide(total, count, out=np.full(len(count), np.nan), where=count > 0)
+        stats['var'] = np.divide(squares - total * stats['avg'].to_numpy(), count - 1,
+                                 out=np.full(len(count), np.nan), where=count > 1)
+        return stats
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/senti-rollup.log', filemode='w')
+    rollup = SentiRollup(Database())
+    rollup.rebuild()
+    print(rollup.stats('senti_avg', 'month').to_string(index=False))
@@ -1,13 +1,73 @@
+import os
+import json
 import time
 import logging
 import argparse
+import numpy as np
 import pandas as pd
+from multiprocessing import Pool
 from sentistrength import PySentiStr
 
+try:
+    from Senti24.senti_worker import get_worker
+    from Senti24.lexicon_scorer import LexiconScorer
+    from Senti24.senti_cache import SentiCache, lexicon_version
+    from Senti24.storage import Database, BASE_GROUP
+    from Senti24.senti_rollup import SentiRollup
+except:
+    from senti_worker import get_worker
+    from lexicon_scorer import LexiconScorer
+    from senti_cache import SentiCache, lexicon_version
+    from storage import Database, BASE_GROUP
+    from senti_rollup import SentiRollup
+
+# SentiScore used by a worker process of the scoring pool
+worker_senti = None
+
+
+def init_worker(jar_loc: str, data_loc: str, backend: str):
+    """
+    Starts SentiStrength inside a worker process of the scoring pool
+    :param jar_loc: Path to SentiStrength.jar
+    :param data_loc: Path to SentiDataFI
+    :param backend: Backend used by the worker
+    :return: Nothing
+    """
+    global worker_senti
+    worker_senti = SentiScore(jar_loc, data_loc, backend=backend)
+
+
+def score_shard(shard: list) -> list:
+    """
+    Scores one shard of texts inside a worker process
+    :param shard: Texts to analyze
+    :return: [Positive score, Negative score] for each text
+    """
+    return worker_senti.get_sentiment(shard)
+
 
 class SentiScore:
-    def __init__(self, jar_loc: str, data_loc: str):
+    def __init__(self, jar_loc: str, data_loc: str, workers: int = 1, min_shard: int = 1000,
+                 backend: str = 'subprocess', cache_path: str = None):
         self.logger = logging.getLogger('senti-score')
+        self.jar_loc = jar_loc
+        self.data_loc = data_loc
+        # 'subprocess' starts SentiStrength for every call, 'server' streams texts through a warm SentiStrength process
+        # and 'lexicon' approximates SentiStrength in Python without Java
+        if backend not in ['subprocess', 'server', 'lexicon']:
+            raise ValueError(f'Unknown sentiment backend {backend}')
+        self.backend = backend
+        self.lexicon = LexiconScorer(data_loc) if backend == 'lexicon' else None
+        # Scores of earlier runs, only unseen strings are sent to SentiStrength
+        self.cache = None
+        if cache_path is not None:
+            self.cache = SentiCache(cache_path, lexicon_version(jar_loc, data_loc, backend))
+        # Number of SentiStrength processes run at once, and the smallest number of texts worth sending to one
+        self.workers = workers
+        self.min_shard = min_shard
+        # Pool of scoring processes, started on first use and kept until close(), so warm SentiStrength workers
+        # live across chunks
+        self.pool = None
         self.senti = PySentiStr()
         self.senti.setSentiStrengthPath(jar_loc)
         self.senti.setSentiStrengthLanguageFolderPath(data_loc)
@@ -18,8 +78,57 @@ class SentiScore:
         :param text: Text to analyze
         :return: [Positive score, Negative score]
         """
+        if self.workers > 1 and not isinstance(text, str) and len(text) >= 2 * self.min_shard:
+            return self.parallel_sentiment(text)
+        if self.backend == 'server':
+            return get_worker(self.jar_loc, self.data_loc).get_sentiment(text)
+        if self.backend == 'lexicon':
+            return self.lexicon.get_sentiment(text)
         return self.senti.getSentiment(text, score='dual')
 
+    def parallel_sentiment(self, arr: list) -> list:
+        """
+        Splits the texts into shards and scores them with several SentiStrength processes at once.
+        The results are merged back in the original order
+        :param arr: Array of text
+        :return: [Positive score, Negative score] for each text
+        """
+        n_shards = min(self.workers, len(arr) // self.min_shard)
+        shards = [list(shard) for shard in np.array_split(np.asarray(arr, dtype=object), n_shards)]
+        self.logger.info(f'Scoring {len(arr)} strings in {n_shards} shards with {self.workers} workers')
+        if self.pool is None:
+            self.pool = Pool(self.workers, initializer=init_worker, initargs=(self.jar_loc, self.data_loc, self.backend))
+        results = self.pool.map(score_shard, shards)
+        return [s for shard in results for s in shard]
+
+    def close(self):
+        """
+        Stops the scoring processes, and the SentiStrength workers running in them
+        :return: Nothing
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def cached_sentiment(self, arr: list) -> list:
+        """
+        Scores only the unique strings that are not in the cache yet, and maps the scores back to every string
+        :param arr: Array of text
+        :return: [Positive score, Negative score] for each text
+        """
+        codes, uniques = pd.factorize(pd.Series(arr, dtype=object), use_na_sentinel=False)
+        keys = [self.cache.key(u) for u in uniques]
+        scores = self.cache.get_many(keys)
+        missing = [i for i, k in enumerate(keys) if k not in scores]
+        self.logger.info(f'{len(uniques)} unique strings, {len(uniques)-len(missing)} found in the cache')
+        if len(missing) > 0:
+            new_scores = dict(zip([keys[i] for i in missing], self.get_sentiment([uniques[i] for i in missing])))
+            self.cache.put_many(new_scores)
+            scores.update(new_scores)
+        unique_scores = np.array([scores[k] for k in keys], dtype=int).reshape(-1, 2)
+        return unique_scores[codes].tolist()
+
     def array_sentiment(self, arr: list) -> list:
         """
         Calculate the positive, negative, the sum of both sentiments for each str in the given array
@@ -28,7 +137,7 @@ class SentiScore:
         """
         self.logger.info(f'Starting sentiment calculation for {len(arr)} strings')
         start = time.time()
-        sentiments = self.get_sentiment(arr)
+        sentiments = self.get_sentiment(arr) if self.cache is None else self.cached_sentiment(arr)
         self.logger.info(f'Sentiment calculation done, took: {time.time()-start}s')
         self.logger.info('Parsing sentiments')
         s_pos, s_neg, s_sum = ([] for i in range(3))
@@ -40,13 +149,12 @@ class SentiScore:
         self.logger.info(f'Sentiments parsed, took {time.time()-start}s')
         return [s_pos, s_neg, s_sum]
 
-    def add_sentiment(self, db) -> pd.DataFrame:
+    def score_chunk(self, db: pd.DataFrame) -> pd.DataFrame:
         """
-        Adds sentiment scores to the preprocessed data. Saves result to data/sentiment_scores.csv
-        :param db: The preprocessed data
-        :return: The modified database
+        Adds the sentiment columns to the given rows
+        :param db: Preprocessed rows with titles and texts
+        :return: The rows with sentiment scores
         """
-        process_start = time.time()
         # Extract texts and titles from the DB
         titles = db['title'].values
         texts = db['text'].values
@@ -62,12 +170,151 @@ class SentiScore:
         db['text_s_neg'] = text_sentiment[1]
         db['text_s_sum'] = text_sentiment[2]
         db['senti_avg'] = (db['title_s_sum'] + db['text_s_sum']) / 2
+        return db
+
+    def add_sentiment(self, db, dst: str = 'data/database') -> pd.DataFrame:
+        """
+        Adds sentiment scores to the preprocessed data. Saves result to the database in data/database/
+        :param db: The preprocessed data
+        :param dst: Root of the database
+        :return: The modified database
+        """
+        process_start = time.time()
+        db = self.score_chunk(db)
+        self.close()
         self.logger.info(f'Whole sentiment analysis done, took {time.time()-process_start}')
-        self.logger.info('Saving result to data/sentiment-scores.csv')
+        self.logger.info(f'Saving result to {dst}')
         # Save the result
-        db.to_csv('data/database.csv', index=False)
+        database = Database(dst)
+        database.clear()
+        database.write(db, BASE_GROUP)
+        rollup = SentiRollup(database)
+        rollup.save(rollup.aggregate(db))
         return db
 
+    def load_checkpoint(self, checkpoint: str, src: str, chunk_size: int) -> dict:
+        """
+        Reads the progress of an earlier streaming run. A checkpoint made for another file or chunk size is ignored
+        :param checkpoint: Path to the checkpoint file
+        :param src: The preprocessed data being scored
+        :param chunk_size: Number of rows in each chunk
+        :return: {src, chunk_size, chunks_done, rows_done}
+        """
+        state = {'src': src, 'chunk_size': chunk_size, 'chunks_done': 0, 'rows_done': 0}
+        if not os.path.exists(checkpoint):
+            return state
+        with open(checkpoint, 'r') as f:
+            saved = json.load(f)
+        if saved.get('src') != src or saved.get('chunk_size') != chunk_size:
+            self.logger.info(f'Checkpoint {checkpoint} belongs to another run, starting from the beginning')
+            return state
+        return saved
+
+    def save_checkpoint(self, checkpoint: str, state: dict):
+        """
+        Atomically writes the streaming progress to the checkpoint file
+        :param checkpoint: Path to the checkpoint file
+        :param state: Progress to save
+        :return: Nothing
+        """
+        tmp = checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, checkpoint)
+
+    def stream_sentiment(self, src: str, dst: str = 'data/database', chunk_size: int = 100000,
+                         checkpoint: str = 'data/senti-score.checkpoint', nrows: int = None) -> int:
+        """
+        Adds sentiment scores to the preprocessed data one chunk at a time, writing each finished chunk as a new
+        part of the database. Progress is written to a checkpoint after every chunk, so an interrupted run
+        continues from the last completed chunk. Only one chunk is held in memory at a time
+        :param src: The preprocessed data, e.g. data/data_combined_preprocessed.csv
+        :param dst: Root of the database
+        :param chunk_size: Number of rows scored at once
+        :param checkpoint: Path to the checkpoint file, removed once the whole file has been scored
+        :param nrows: Only score this many rows from the beginning of src
+        :return: Number of scored rows
+        """
+        process_start = time.time()
+        database = Database(dst)
+        state = self.load_checkpoint(checkpoint, src, chunk_size)
+        if state['chunks_done'] > 0 and database.exists():
+            self.logger.info(f'Resuming after chunk {state["chunks_done"]} ({state["rows_done"]} rows)')
+            # Drop anything written after the last completed chunk
+            database.drop_parts(BASE_GROUP, state['chunks_done'])
+        else:
+            state.update(chunks_done=0, rows_done=0)
+            database.clear()
+        try:
+            for i, chunk in enumerate(pd.read_csv(src, chunksize=chunk_size, nrows=nrows)):
+                if i < state['chunks_done']:
+                    continue
+                start = time.time()
+                chunk = self.score_chunk(chunk)
+                database.append(chunk, BASE_GROUP, i)
+                state['chunks_done'] = i + 1
+                state['rows_done'] += len(chunk)
+                self.save_checkpoint(checkpoint, state)
+                self.logger.info(f'Chunk {i+1} done ({state["rows_done"]} rows in total), '
+                                 f'took {time.time()-start}s')
+        finally:
+            # Stop the scoring processes started for this run
+            self.close()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        SentiRollup(database).rebuild()
+        self.logger.info(f'Whole sentiment analysis done, took {time.time()-process_start}')
+        return state['rows_done']
+
+    def update_sentiment(self, src: str, dst: str = 'data/database', chunk_size: int = 100000,
+                         keys: [str] = ('thread_id', 'datetime')) -> int:
+        """
+        Scores only the rows of src that are not in the database yet (matched by thread_id and datetime), and
+        appends them to the database. Columns added by later analysis steps are left empty for the new rows.
+        Running it again after an interruption continues where it stopped, as appended rows are found in the database
+        :param src: The preprocessed data, e.g. data/data_combined_preprocessed.csv
+        :param dst: Root of the existing database with sentiment scores
+        :param chunk_size: Number of rows read from src at once
+        :param keys: Columns identifying a thread
+        :return: Number of added rows
+        """
+        database = Database(dst)
+        if not database.exists():
+            self.logger.info(f'{dst} does not exist, scoring all of {src}')
+            return self.stream_sentiment(src, dst, chunk_size)
+        process_start = time.time()
+        keys = list(keys)
+        self.logger.info(f'Reading the scored threads from {dst}')
+        existing = database.read(keys)
+        last_datetime = existing['datetime'].max()
+        scored = pd.MultiIndex.from_frame(existing)
+        existing = None
+        # Make sure the rollup covers the scored threads before adding the new ones to it
+        rollup = SentiRollup(database)
+        rollup.load()
+        part = database.next_part(BASE_GROUP)
+        added = 0
+        try:
+            for chunk in pd.read_csv(src, chunksize=chunk_size):
+                new = chunk[~pd.MultiIndex.from_frame(chunk[keys]).isin(scored)]
+                if len(new) == 0:
+                    continue
+                new = self.score_chunk(new.copy())
+                if new['datetime'].min() < last_datetime:
+                    self.logger.info('Some of the new threads are older than the scored ones, '
+                                     'they are added after the scored threads of the same month')
+                database.append(new, BASE_GROUP, part)
+                rollup.add(new)
+                part += 1
+                scored = scored.append(pd.MultiIndex.from_frame(new[keys]))
+                added += len(new)
+                self.logger.info(f'Added {len(new)} new threads ({added} in total)')
+        finally:
+            # Stop the scoring processes started for this run
+            self.close()
+        self.logger.info(f'Incremental sentiment analysis done, added {added} threads, '
+                         f'took {time.time()-process_start}s')
+        return added
 
 if __name__ == '__main__':
     # Set logging format
@@ -77,26 +324,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-j', type=str, help='Absolute path to SentiStrength.jar')
     parser.add_argument('-d', type=str, help='Absolute path to SentiStrength_DataFi')
+    parser.add_argument('-c', type=int, default=100000, help='Number of rows scored per checkpointed chunk')
+    parser.add_argument('-w', type=int, default=os.cpu_count(), help='Number of SentiStrength processes run at once')
+    parser.add_argument('-b', type=str, default='server', choices=['subprocess', 'server', 'lexicon'],
+                        help='Start SentiStrength for every chunk (subprocess), keep it running (server), '
+                             'or use the approximate Python scorer (lexicon)')
+    parser.add_argument('-k', type=str, default='data/senti-cache.sqlite', help='Path to the sentiment cache')
+    parser.add_argument('-u', action='store_true', help='Only score threads missing from data/database/')
     args = parser.parse_args()
     # Start SentiStrength
-    senti = SentiScore(args.j, args.d)
-    # Load the preprocessed data for sentiment analysis
-    data = pd.read_csv('data/data_combined_preprocessed.csv')
-
-    # Extract titles and text from the data
-    titles = data['title'].values
-    texts = data['text'].values
-    # Calculate sentiments for titles and texts
-    title_sentiment = senti.array_sentiment(titles)
-    text_sentiment = senti.array_sentiment(texts)
-    # Add sentiment to the data
-    data['title_s_pos'] = title_sentiment[0]
-    data['title_s_neg'] = title_sentiment[1]
-    data['title_s_sum'] = title_sentiment[2]
-    data['text_s_pos'] = text_sentiment[0]
-    data['text_s_neg'] = text_sentiment[1]
-    data['text_s_sum'] = text_sentiment[2]
-    data['senti_avg'] = (data['title_s_sum'] + data['text_s_sum']) / 2
-    # Save the result
-    data.to_csv('data/database.csv', index=False)
-
+    senti = SentiScore(args.j, args.d, workers=args.w, backend=args.b, cache_path=args.k)
+    if args.u:
+        # Add scores for the new threads only
+        senti.update_sentiment('data/data_combined_preprocessed.csv', 'data/database', args.c)
+    else:
+        # Calculate sentiments for titles and texts chunk by chunk, and save the result to data/database/.
+        # If the run is interrupted, running the same command again continues from the last finished chunk
+        senti.stream_sentiment('data/data_combined_preprocessed.csv', 'data/database', args.c)
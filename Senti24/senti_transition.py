@@ -1,6 +1,13 @@
 import time
 import logging
+import numpy as np
 import pandas as pd
+
+try:
+    from Senti24.storage import Database
+except:
+    from storage import Database
+
 """
 The created dataframe is:
     to  to  to
@@ -37,6 +44,15 @@ class SentiTransition:
             return 'neg'
         return 'neu'
 
+    def get_classes(self, data) -> np.ndarray:
+        """
+        Same classification as get_class, for a whole array at once
+        :param data: Sentiment scores
+        :return: Index of the class in self.classes for each score
+        """
+        data = np.asarray(data, dtype=float)
+        return np.where(data > 0.5, 0, np.where(data < -0.5, 1, 2))
+
     def calculate_transitions(self, data):
         """
         Calculate the sentiment transitions for the given data. Also saves the result
@@ -45,8 +61,12 @@ class SentiTransition:
         """
         self.logger.info('Starting transition calculations')
         start = time.time()
-        for i in range(len(data)-1):
-            self.transitions['_'.join([self.get_class(data[i]), self.get_class(data[i+1])])] += 1
+        codes = self.get_classes(data)
+        # Each pair of consecutive classes is a cell of the 3x3 matrix
+        counts = np.bincount(codes[:-1] * 3 + codes[1:], minlength=9).reshape(3, 3)
+        for i, frm in enumerate(self.classes):
+            for j, to in enumerate(self.classes):
+                self.transitions[f'{frm}_{to}'] = int(counts[i, j])
         self.logger.info(f'Transitions calculated, process took {time.time()-start}s')
         self.save_transitions()
 
@@ -57,20 +77,18 @@ class SentiTransition:
         """
         self.logger.info('Saving results to data/sentiment-transitions.csv')
         start = time.time()
-        for key in self.transitions.keys():
-            frm, to = key.split('_')
-            self.df.loc[[frm], [to]] = self.transitions[key]
+        self.df = pd.DataFrame([[self.transitions[f'{frm}_{to}'] for to in self.classes] for frm in self.classes],
+                               self.classes, self.classes)
         self.df.to_csv('data/sentiment-transitions.csv')
         self.logger.info(f'Results saved, took {time.time()-start}s')
         self.logger.info(f'The result is:\n{self.df}')
 
-
 if __name__ == '__main__':
     # Set logging format
     logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
                         datefmt='%H:%M:%S', filename='logs/senti-transitions.log', filemode='w')
     # Read the sentiment dat
-    data = pd.read_csv('data/database.csv')
+    data = Database().read(['senti_avg'])
     # Create the SentiTransition object
     st = SentiTransition()
     # Get a list of sentiment averages
@@ -0,0 +1,136 @@
+import atexit
+import logging
+import threading
+import subprocess
+from time import time
+
+"""
+Long-lived SentiStrength process. Starts the JVM and loads SentiDataFI once, after which texts are streamed
+through its stdin/stdout one line at a time (SentiStrength's 'cmd' mode)
+"""
+
+# Warm workers shared inside this process, by (jar, data folder)
+workers = {}
+workers_lock = threading.Lock()
+
+
+class SentiWorker:
+    def __init__(self, jar_loc: str, data_loc: str, window: int = 1000):
+        self.logger = logging.getLogger('senti-worker')
+        self.jar_loc = jar_loc
+        self.data_loc = data_loc
+        # Number of lines written before reading their results, keeps both pipes from filling up
+        self.window = window
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts SentiStrength in 'cmd' mode
+        :return: Nothing
+        """
+        self.logger.info(f'Starting SentiStrength worker with {self.jar_loc} and {self.data_loc}')
+        start = time()
+        self.process = subprocess.Popen(['java', '-jar', self.jar_loc, 'sentidata', self.data_loc, 'cmd'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        encoding='utf-8', bufsize=1)
+        self.logger.info(f'SentiStrength worker started, took {time()-start}s')
+
+    def alive(self) -> bool:
+        """
+        :return: True if the SentiStrength process is running
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        """
+        Stops the SentiStrength process
+        :return: Nothing
+        """
+        if self.alive():
+            self.logger.info('Stopping SentiStrength worker')
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def encode(self, text) -> str:
+        """
+        Turns a text into a single input line, spaces are sent as '+' like PySentiStr does
+        :param text: Text to analyze
+        :return: The input line
+        """
+        return str(text).replace('\n', ' ').replace('\r', ' ').strip().replace(' ', '+')
+
+    def get_sentiment(self, text: str or list) -> list:
+        """
+        Determine the sentiment of the given texts with the running SentiStrength process
+        :param text: Text or list of texts to analyze
+        :return: [Positive score, Negative score] for each text
+        """
+        texts = [text] if isinstance(text, str) else text
+        lines = [self.encode(t) for t in texts]
+        result = []
+        with self.lock:
+            if not self.alive():
+                self.start()
+            try:
+                for i in range(0, len(lines), self.window):
+                    result.extend(self.score_window(lines[i:i + self.window]))
+            except (BrokenPipeError, ValueError):
+                self.stop()
+                raise RuntimeError('SentiStrength worker stopped unexpectedly')
+        return result
+
+    def score_window(self, lines: [str]) -> list:
+        """
+        Writes a window of lines to SentiStrength and reads one result line for each
+        :param lines: Encoded texts
+        :return: [Positive score, Negative score] for each line
+        """
+        # SentiStrength does not answer empty lines, those are neutral
+        sent = [line for line in lines if line != '']
+        self.process.stdin.write(''.join(line + '\n' for line in sent))
+        self.process.stdin.flush()
+        scores = iter([self.parse(self.process.stdout.readline()) for _ in sent])
+        return [next(scores) if line != '' else (1, -1) for line in lines]
+
+    def parse(self, line: str) -> tuple:
+        """
+        :param line: Output line of SentiStrength, e.g. '3 -1'
+        :return: (Positive score, Negative score)
+        """
+        values = line.split()
+        if len(values) < 2:
+            raise ValueError(f'Unexpected SentiStrength output: {line!r}')
+        return int(values[0]), int(values[1])
+
+
+def get_worker(jar_loc: str, data_loc: str) -> SentiWorker:
+    """
+    Returns the warm SentiStrength worker of this process, starting one if needed
+    :param jar_loc: Path to SentiStrength.jar
+    :param data_loc: Path to SentiDataFI
+    :return: The shared worker
+    """
+    with workers_lock:
+        key = (jar_loc, data_loc)
+        if key not in workers:
+            workers[key] = SentiWorker(jar_loc, data_loc)
+        return workers[key]
+
+
+def stop_workers():
+    """
+    Stops every worker started by get_worker
+    :return: Nothing
+    """
+    with workers_lock:
+        for worker in workers.values():
+            worker.stop()
+        workers.clear()
+
+
+atexit.register(stop_workers)
@@ -0,0 +1,363 @@
+import os
+import json
+import hashlib
+import shutil
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from glob import glob
+from time import time
+
+"""
+Columnar storage for the analysis database, replaces data/database.csv.
+Rows are partitioned by year and month, and every analysis step stores the columns it adds as its own group:
+    data/database/year=2009/month=01/sentiment-00000.parquet
+    data/database/year=2009/month=01/categorization-00000.parquet
+    data/database/_groups.json    {group: [columns]}
+Inside a partition every group holds the same rows in the same order. A group may consist of several parts
+(e.g. one per scored chunk), which are read in order. If rows have been appended to the sentiment group after
+another group was written, the missing values of that group are empty
+"""
+
+# Group that holds the threads themselves, defines the rows of each partition
+BASE_GROUP = 'sentiment'
+# Columns added by the later analysis steps, used when importing an existing database.csv
+COLUMN_GROUPS = {
+    'categorization': ['title_length', 'text_length', 'n_of_words_title', 'n_of_words_text',
+                       'n_of_question_marks', 'n_of_exclamation_marks', 'n_of_question_words',
+                       'n_of_swear_words', 'n_of_negatives', 'n_of_neg_adjectives',
+                       'n_of_pos_adjectives', 'neg_adj_avg_sentiment', 'pos_adj_avg_sentiment',
+                       'simple_heuristic_cat'],
+    'kmeans': ['kmeans_cat'],
+}
+# Compact dtypes of the database columns. Sentiment scores are within -5...5, and counts of words of
+# a kind fit into int16. Integer columns with missing values use the nullable version of the same size
+SCHEMA = {
+    'thread_id': 'int64', 'year': 'int16', 'month': 'int8',
+    'title_s_pos': 'int8', 'title_s_neg': 'int8', 'title_s_sum': 'int8',
+    'text_s_pos': 'int8', 'text_s_neg': 'int8', 'text_s_sum': 'int8',
+    'title_length': 'int32', 'text_length': 'int32', 'n_of_words_title': 'int32', 'n_of_words_text': 'int32',
+    'n_of_question_marks': 'int16', 'n_of_exclamation_marks': 'int16', 'n_of_question_words': 'int16',
+    'n_of_swear_words': 'int16', 'n_of_negatives': 'int16', 'n_of_neg_adjectives': 'int16',
+    'n_of_pos_adjectives': 'int16',
+    'simple_heuristic_cat': 'category', 'kmeans_cat': 'category',
+}
+# Columns that can be loaded as Arrow backed strings instead of Python objects
+TEXT_COLUMNS = ['title', 'text', 'datetime']
+
+
+def apply_schema(df: pd.DataFrame, text_dtype: str = None) -> pd.DataFrame:
+    """
+    Converts the columns of df to the compact dtypes of SCHEMA. A column whose values don't fit the smaller
+    type keeps its current dtype
+    :param df: Part of the database
+    :param text_dtype: Dtype for the text columns, e.g. 'string[pyarrow]'. Left as they are if None
+    :return: df with converted columns
+    """
+    for col, dtype in SCHEMA.items():
+        if col not in df or str(df[col].dtype) in [dtype, dtype.capitalize()]:
+            continue
+        if dtype.startswith('int'):
+            values = df[col].dropna()
+            info = np.iinfo(dtype)
+            if len(values) > 0 and (values.min() < info.min or values.max() > info.max or (values % 1 != 0).any()):
+                continue
+            if len(values) < len(df):
+                dtype = dtype.capitalize()
+        df[col] = df[col].astype(dtype)
+    if text_dtype is not None:
+        for col in TEXT_COLUMNS:
+            if col in df:
+                df[col] = df[col].astype(text_dtype)
+    return df
+
+
+def concat_categoricals(frames: [pd.DataFrame]) -> [pd.DataFrame]:
+    """
+    Gives the categorical columns of every frame the same categories, so concatenating keeps them categorical
+    :param frames: Parts of the database
+    :return: The frames
+    """
+    if len(frames) == 0:
+        return frames
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.Index([])
+            for df in frames:
+                categories = categories.union(df[col].cat.categories)
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return frames
+
+
+class Database:
+    def __init__(self, root: str = 'data/database'):
+        self.logger = logging.getLogger('database')
+        self.root = root
+        self.groups_file = os.path.join(root, '_groups.json')
+
+    def exists(self) -> bool:
+        """
+        :return: True if the database contains scored threads
+        """
+        return os.path.exists(self.groups_file) and len(self.partitions()) > 0
+
+    def clear(self):
+        """
+        Removes the whole database
+        :return: Nothing
+        """
+        if os.path.exists(self.root):
+            self.logger.info(f'Removing {self.root}')
+            shutil.rmtree(self.root)
+
+    def load_groups(self) -> dict:
+        """
+        :return: {group: [columns]}
+        """
+        if not os.path.exists(self.groups_file):
+            return {}
+        with open(self.groups_file, 'r') as f:
+            return json.load(f)
+
+    def save_groups(self, group: str, columns: [str]):
+        """
+        Records the columns stored in a group
+        :param group: Name of the group
+        :param columns: Columns of the group
+        :return: Nothing
+        """
+        groups = self.load_groups()
+        groups[group] = list(columns)
+        # Keep the threads first when columns are listed
+        groups = {g: groups[g] for g in sorted(groups, key=lambda g: g != BASE_GROUP)}
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.groups_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(groups, f)
+        os.replace(tmp, self.groups_file)
+
+    def columns(self) -> [str]:
+        """
+        :return: All columns in the database
+        """
+        return [c for cols in self.load_groups().values() for c in cols]
+
+    def partition_dir(self, year: int, month: int) -> str:
+        return os.path.join(self.root, f'year={int(year)}', f'month={int(month):02d}')
+
+    def partitions(self, years: [int] = None, months: [int] = None) -> [(int, int)]:
+        """
+        Lists the partitions in chronological order. Partitions outside the given years and months are skipped
+        without being opened
+        :param years: Only these years, all if None
+        :param months: Only these months, all if None
+        :return: [(year, month)]
+        """
+        result = []
+        for year_dir in glob(os.path.join(self.root, 'year=*')):
+            year = int(os.path.basename(year_dir).split('=')[1])
+            if years is not None and year not in years:
+                continue
+            for month_dir in glob(os.path.join(year_dir, 'month=*')):
+                month = int(os.path.basename(month_dir).split('=')[1])
+                if months is not None and month not in months:
+                    continue
+                result.append((year, month))
+        return sorted(result)
+
+    def group_files(self, year: int, month: int, group: str) -> [str]:
+        """
+        :return: Parquet files of a group in a partition, in the order they were written
+        """
+        return sorted(glob(os.path.join(self.partition_dir(year, month), f'{group}-*.parquet')))
+
+    def num_rows(self, year: int, month: int, group: str = BASE_GROUP) -> int:
+        """
+        Counts the rows of a group in a partition from the parquet metadata, without reading the data
+        """
+        return sum(pq.ParquetFile(f).metadata.num_rows for f in self.group_files(year, month, group))
+
+    def version(self, columns: [str] = None) -> str:
+        """
+        Fingerprints the stored data from the names, sizes and modification times of the files, without reading them
+        :param columns: Only the groups holding these columns, all if None
+        :return: Version string, changes whenever one of the groups is written
+        """
+        h = hashlib.sha1()
+        for group, group_cols in self.load_groups().items():
+            if columns is not None and not any(c in columns for c in group_cols):
+                continue
+            for year, month in self.partitions():
+                for file in self.group_files(year, month, group):
+                    stat = os.stat(file)
+                    h.update(f'{file}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+        return h.hexdigest()
+
+    def read_partition(self, year: int, month: int, columns: [str] = None, text_dtype: str = None) -> pd.DataFrame:
+        """
+        Reads the requested columns of one partition, opening only the groups holding them
+        :param year: Year of the partition
+        :param month: Month of the partition
+        :param columns: Columns to read, all if None
+        :param text_dtype: Dtype for titles, texts and datetimes, e.g. 'string[pyarrow]'. Python objects if None
+        :return: The rows of the partition
+        """
+        n = self.num_rows(year, month)
+        frames = []
+        for group, group_cols in self.load_groups().items():
+            cols = group_cols if columns is None else [c for c in group_cols if c in columns]
+            if len(cols) == 0:
+                continue
+            files = self.group_files(year, month, group)
+            if len(files) > 0:
+                df = pd.concat(concat_categoricals([pd.read_parquet(f, columns=cols) for f in files]),
+                               ignore_index=True)
+            else:
+                df = pd.DataFrame(columns=cols)
+            if len(df) != n:
+                self.logger.info(f'{group} has {len(df)} of {n} rows for {year}-{month:02d}, rerun that step '
+                                 f'to fill in the new threads')
+            frames.append(df.reindex(range(n)))
+        df = pd.concat(frames, axis=1) if len(frames) > 0 else pd.DataFrame(index=range(n))
+        df = apply_schema(df, text_dtype)
+        return df if columns is None else df[[c for c in columns if c in df]]
+
+    def iter_partitions(self, columns: [str] = None, years: [int] = None, months: [int] = None,
+                        text_dtype: str = None):
+        """
+        Reads the database one partition at a time
+        :param columns: Columns to read, all if None
+        :param years: Only these years, all if None
+        :param months: Only these months, all if None
+        :param text_dtype: Dtype for titles, texts and datetimes, e.g. 'string[pyarrow]'. Python objects if None
+        :return: Generator of (year, month, DataFrame)
+        """
+        for year, month in self.partitions(years, months):
+            yield year, month, self.read_partition(year, month, columns, text_dtype)
+
+    def read(self, columns: [str] = None, years: [int] = None, months: [int] = None,
+             text_dtype: str = None) -> pd.DataFrame:
+        """
+        Reads the database in chronological order, with the compact dtypes of SCHEMA
+        :param columns: Columns to read, all if None
+        :param years: Only these years, all if None
+        :param months: Only these months, all if None
+        :param text_dtype: Dtype for titles, texts and datetimes. 'string[pyarrow]' takes far less memory than
+                           the default Python objects
+        :return: The database
+        """
+        self.logger.info(f'Reading {self.root}' + (f', columns {columns}' if columns is not None else ''))
+        start = time()
+        frames = [df for _, _, df in self.iter_partitions(columns, years, months, text_dtype)]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns if columns is not None else self.columns())
+        df = pd.concat(concat_categoricals(frames), ignore_index=True)
+        self.logger.info(f'Read {len(df)} rows, took {time()-start}s')
+        return df
+
+    def split(self, df: pd.DataFrame):
+        """
+        Splits rows into partitions, keeping their order inside each partition
+        :param df: Rows with year and month columns
+        :return: Generator of (year, month, rows)
+        """
+        for (year, month), rows in df.groupby(['year', 'month'], sort=True):
+            yield year, month, rows
+
+    def write(self, df: pd.DataFrame, group: str, columns: [str] = None):
+        """
+        Replaces a group in every partition present in df. df must hold all rows of those partitions in
+        the stored order, as returned by read()
+        :param df: Rows with year and month columns
+        :param group: Name of the group
+        :param columns: Columns to store in the group, all of df if None
+        :return: Nothing
+        """
+        columns = list(df.columns) if columns is None else list(columns)
+        self.logger.info(f'Writing {columns} to {self.root} as {group}')
+        start = time()
+        for year, month, rows in self.split(df):
+            for f in self.group_files(year, month, group):
+                os.remove(f)
+            self.write_part(rows[columns], year, month, group, 0)
+        self.save_groups(group, columns)
+        self.logger.info(f'Done writing, took {time()-start}s')
+
+    def append(self, df: pd.DataFrame, group: str, part: int, columns: [str] = None):
+        """
+        Writes rows as a new part of a group. Writing the same part again replaces it
+        :param df: Rows with year and month columns
+        :param group: Name of the group
+        :param part: Number of the part, parts are read in increasing order
+        :param columns: Columns to store in the group, all of df if None
+        :return: Nothing
+        """
+        columns = list(df.columns) if columns is None else list(columns)
+        for year, month, rows in self.split(df):
+            self.write_part(rows[columns], year, month, group, part)
+        if group not in self.load_groups():
+            self.save_groups(group, columns)
+
+    def write_part(self, df: pd.DataFrame, year: int, month: int, group: str, part: int):
+        """
+        Writes one parquet file, through a temporary file so a crash never leaves a partial part behind
+        """
+        os.makedirs(self.partition_dir(year, month), exist_ok=True)
+        file = os.path.join(self.partition_dir(year, month), f'{group}-{part:05d}.parquet')
+        apply_schema(df.copy()).to_parquet(file + '.tmp', index=False)
+        os.replace(file + '.tmp', file)
+
+    def drop_parts(self, group: str, from_part: int):
+        """
+        Removes the parts of a group numbered from_part or higher, e.g. after an interrupted run
+        :param group: Name of the group
+        :param from_part: First part to remove
+        :return: Nothing
+        """
+        for f in glob(os.path.join(self.root, 'year=*', 'month=*', f'{group}-*.parquet')):
+            if int(os.path.basename(f)[len(group) + 1:-len('.parquet')]) >= from_part:
+                os.remove(f)
+
+    def next_part(self, group: str) -> int:
+        """
+        :param group: Name of the group
+        :return: Part number following every existing part of the group
+        """
+        parts = [int(os.path.basename(f)[len(group) + 1:-len('.parquet')])
+                 for f in glob(os.path.join(self.root, 'year=*', 'month=*', f'{group}-*.parquet'))]
+        return max(parts) + 1 if len(parts) > 0 else 0
+
+    def import_csv(self, file: str, chunk_size: int = 500000):
+        """
+        Converts an existing database.csv into the partitioned database
+        :param file: Path to the csv file
+        :param chunk_size: Number of rows converted at once
+        :return: Nothing
+        """
+        self.logger.info(f'Importing {file} into {self.root}')
+        start = time()
+        self.clear()
+        for i, chunk in enumerate(pd.read_csv(file, chunksize=chunk_size)):
+            grouped = []
+            for group, cols in COLUMN_GROUPS.items():
+                cols = [c for c in cols if c in chunk]
+                if len(cols) > 0:
+                    self.append(chunk, group, i, cols)
+                    grouped.extend(cols)
+            self.append(chunk, BASE_GROUP, i, [c for c in chunk if c not in grouped])
+        self.logger.info(f'Import done, took {time()-start}s')
+
+
+if __name__ == '__main__':
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/storage.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', type=str, default='data/database.csv', help='Database csv file to import')
+    args = parser.parse_args()
+    # Convert a database.csv created by an older version
+    Database().import_csv(args.f)
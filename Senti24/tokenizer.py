@@ -0,0 +1,87 @@
+import re
+import logging
+import argparse
+import pandas as pd
+from time import time
+
+"""
+Tokenizer for texts that only contain the characters kept by the preprocessing (a-z åäö-_!? and space).
+Gives the same tokens as nltk.word_tokenize on such texts, including its contractions (cannot -> can not),
+without running its dozens of regexes on every text
+"""
+
+# '--', '!' and '?' are tokens of their own, everything else is split at whitespace
+TOKEN = re.compile(r"--|[?!]|(?:[^\s?!-]|-(?!-))+")
+# word_tokenize's rules for ',', ':' and '.', in the order it applies them. Only the finnpos labeling keeps these
+PUNCTUATION = [
+    (re.compile(r"([^.])(\.)\s*$"), r"\1 \2 "),
+    (re.compile(r"([:,])([^\d])"), r" \1 \2"),
+    (re.compile(r"([:,])$"), r" \1 "),
+    (re.compile(r"\.{2,}"), r" \g<0> "),
+    (re.compile(r"([^.])(\.)\s*$"), r"\1 \2 "),
+]
+# word_tokenize's contractions (CONTRACTIONS2 and CONTRACTIONS3 of nltk's MacIntyreContractions), e.g. cannot -> can not
+CONTRACTIONS = [re.compile(pattern) for pattern in [
+    r"(?i)\b(can)(?#X)(not)\b",
+    r"(?i)\b(d)(?#X)('ye)\b",
+    r"(?i)\b(gim)(?#X)(me)\b",
+    r"(?i)\b(gon)(?#X)(na)\b",
+    r"(?i)\b(got)(?#X)(ta)\b",
+    r"(?i)\b(lem)(?#X)(me)\b",
+    r"(?i)\b(more)(?#X)('n)\b",
+    r"(?i)\b(wan)(?#X)(na)(?=\s)",
+    r"(?i) ('t)(?#X)(is)\b",
+    r"(?i) ('t)(?#X)(was)\b",
+]]
+# Tokens word_tokenize surrounds with spaces before applying the contractions
+SEPARATE = re.compile(r"--|[?!]")
+# Texts without any of these can't contain a contraction
+CONTRACTION_HINT = re.compile(r"(?i)cannot|'ye|gimme|gonna|gotta|lemme|'n|wanna|'t")
+
+
+def tokenize(text: str) -> [str]:
+    """
+    Splits a text into tokens like nltk.word_tokenize(text, preserve_line=True), including its contractions
+    (cannot -> can, not and gonna -> gon, na). On the preprocessed character set this is the same as
+    word_tokenize(text). With periods inside the text word_tokenize would also split the text into sentences,
+    here only the final period is split off
+    :param text: Text to tokenize
+    :return: List of tokens
+    """
+    if ',' in text or '.' in text or ':' in text:
+        for regex, substitution in PUNCTUATION:
+            text = regex.sub(substitution, text)
+    if CONTRACTION_HINT.search(text):
+        # Padded like in word_tokenize, so that a contraction at the end of the text or before '?', '!' or '--'
+        # is followed by a space
+        text = ' ' + SEPARATE.sub(r' \g<0> ', text) + ' '
+        for regex in CONTRACTIONS:
+            text = regex.sub(r' \1 \2 ', text)
+    return TOKEN.findall(text)
+
+
+if __name__ == '__main__':
+    from nltk import word_tokenize
+    # Set logging format
+    logging.basicConfig(format='%(asctime)s %(module)s: %(message)s', level=logging.INFO,
+                        datefmt='%H:%M:%S', filename='logs/tokenizer.log', filemode='w')
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', type=str, default='data/data_combined_preprocessed.csv', help='Preprocessed data')
+    parser.add_argument('-n', type=int, default=100000, help='Number of titles and texts to compare')
+    args = parser.parse_args()
+    # Compare the tokens and the running times against word_tokenize on the corpus
+    data = pd.read_csv(args.f, usecols=['title', 'text'], nrows=args.n)
+    texts = [str(t) for t in pd.concat([data['title'], data['text']]).values]
+    start = time()
+    expected = [word_tokenize(t) for t in texts]
+    nltk_time = time() - start
+    start = time()
+    result = [tokenize(t) for t in texts]
+    own_time = time() - start
+    mismatches = [t for t, a, b in zip(texts, expected, result) if a != b]
+    logging.info(f'word_tokenize took {nltk_time}s, tokenize took {own_time}s ({nltk_time/own_time:.1f}x faster)')
+    logging.info(f'{len(mismatches)} of {len(texts)} texts tokenized differently')
+    for text in mismatches[:10]:
+        logging.info(f'Mismatch: {text!r}')
+    print(f'{len(mismatches)} mismatches in {len(texts)} texts, {nltk_time/own_time:.1f}x faster than word_tokenize')
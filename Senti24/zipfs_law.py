@@ -6,6 +6,11 @@ import scipy.stats as ss
 from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 
+try:
+    from Senti24.storage import Database
+except:
+    from storage import Database
+
 
 class ZipfsLaw:
     def __init__(self, data: pd.DataFrame):
@@ -80,6 +85,6 @@ class ZipfsLaw:
 
 
 if __name__ == '__main__':
-    data = pd.read_csv('data/database.csv')
+    data = Database().read(['simple_heuristic_cat'])
     fig = ZipfsLaw(data.simple_heuristic_cat).fit_zipfs_law()
     fig.savefig('zipf.png', format="png")
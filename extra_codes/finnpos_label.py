@@ -3,9 +3,9 @@ import logging
 import subprocess
 import pandas as pd
 from time import time
-from nltk import word_tokenize
 from random import sample, seed
 from senti_score2 import SentiScore
+from tokenizer import tokenize
 
 """
 Used to get sentiment of adjectives present in the threads
@@ -70,8 +70,8 @@ def write_to_file(titles, texts, year):
     for i in range(len(titles)):
         titles[i] = ''.join(regex.findall(titles[i]))
         texts[i] = ''.join(regex.findall(texts[i]))
-        title_tokes = word_tokenize(titles[i])
-        text_tokens = word_tokenize(texts[i])
+        title_tokes = tokenize(titles[i])
+        text_tokens = tokenize(texts[i])
         for token in title_tokes:
             f.write(token+'\n')
         f.write('\n')
@@ -132,7 +132,7 @@ def add_sentiment(senti: SentiScore, labeled: pd.DataFrame) -> [str, str, int, i
 
 
 if __name__ == '__main__':
-    senti = SentiScore('.../SentiStr/SentiStrength.jar', '.../SentiStr/SentiDataFI')
+    senti = SentiScore('.../SentiStr/SentiStrength.jar', '.../SentiStr/SentiDataFI', backend='server')
     years = [str(i) for i in range(2009, 2018)]
     for year in years:
         titles, texts, thread_ids = read_random_for_year(year, num_of_samples)
@@ -1,7 +1,11 @@
+import os
+import sys
 import pandas as pd
 import logging
 import re
-from nltk import word_tokenize
+# The tokenizer is in Senti24/, next to this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Senti24'))
+from tokenizer import tokenize
 
 """
 Preprocessing the thread titles
@@ -25,7 +29,7 @@ class PreProcessor:
         """
         Removes stopwords from the given text string, and retuns the cleaned result.
         """
-        text_tokens = word_tokenize(text)
+        text_tokens = tokenize(text)
         tokens_without_sw = [word for word in text_tokens if not word in self.stopwords]
         return (" ").join(tokens_without_sw)
 
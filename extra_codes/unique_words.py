@@ -15,7 +15,7 @@ WAS NOT USED IN THE ANALYSIS
 class UniqueWords:
     def __init__(self, filename: str, save_to: str):
         self.logger = logging.getLogger('unique-words')
-        self.senti = SentiScore('<ADD JAR HERE>', '<ADD SentiDataFI HERE>')
+        self.senti = SentiScore('<ADD JAR HERE>', '<ADD SentiDataFI HERE>', backend='server')
         self.filename = filename
         self.save_to = save_to
         self.db = None
@@ -1,6 +1,6 @@
 import io
 import logging
-from os import path
+from os import path, cpu_count
 import pandas as pd
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
@@ -10,16 +10,21 @@ from Senti24.senti_score2 import SentiScore
 from Senti24.senti_transition import SentiTransition
 from Senti24.senti_correlation import SentiCorrelation
 from Senti24.senti_plot import SentiPlot
+from Senti24.senti_rollup import SentiRollup
 from Senti24.categorization import Categorizer
 from Senti24.category_transitions import CategoryTransitions
 from Senti24.zipfs_law import ZipfsLaw
-from Senti24.kmeans_categorization import KmeansCategorization
+from Senti24.kmeans_categorization import KmeansCategorization, KMEANS_FEATURES
+from Senti24.kmeans_selection import KmeansSelection
+from Senti24.storage import Database
+from Senti24.period_transitions import PeriodTransitions, PERIOD_COLUMNS
 
 app = Flask(__name__, template_folder='templates')
 # PATHS
 senti_jar_path = ''
 senti_data_path = ''
 # DATA
+database = Database('data/database')
 db = None
 kmeans_cat = None
 # What To Do
@@ -100,10 +105,21 @@ def determine_analysis(what: str):
         if not path.exists('data/data_combined_preprocessed.csv'):
             return ['block', 'Could not find the pre-processed data data/data_combined_preprocessed.csv', 'none', '']
         # Create the SentiScore object
-        senti = SentiScore(senti_jar_path, senti_data_path)
-        # Update the database with sentiments, and save result
-        db = senti.add_sentiment(pd.read_csv('data/data_combined_preprocessed.csv'))
-        return ['block', 'Sentiment Scores added! You can view the result in the file data/database.csv', 'none', '']
+        senti = SentiScore(senti_jar_path, senti_data_path, workers=cpu_count(), backend='server',
+                           cache_path='data/senti-cache.sqlite')
+        # Update the database with sentiments chunk by chunk, and save result. Continues an interrupted run
+        senti.stream_sentiment('data/data_combined_preprocessed.csv', 'data/database')
+        db = None  # Loaded from data/database/ when needed
+        return ['block', 'Sentiment Scores added! You can view the result in data/database/', 'none', '']
+    # Sentiment calculation for threads missing from the database
+    elif what == 'sentiScoreNew':
+        if not path.exists('data/data_combined_preprocessed.csv'):
+            return ['block', 'Could not find the pre-processed data data/data_combined_preprocessed.csv', 'none', '']
+        senti = SentiScore(senti_jar_path, senti_data_path, workers=cpu_count(), backend='server',
+                           cache_path='data/senti-cache.sqlite')
+        added = senti.update_sentiment('data/data_combined_preprocessed.csv', 'data/database')
+        db = None  # Loaded from data/database/ when needed
+        return ['block', f'Sentiment Scores added for {added} new threads! You can view the result in data/database/', 'none', '']
     # Sentiment transition calculation
     elif what == 'sentiTransition':
         # Check memory
@@ -112,9 +128,9 @@ def determine_analysis(what: str):
             SentiTransition().calculate_transitions(db['senti_avg'].values)
             return ['block', 'Number of sentiment transitions calculated. You can check the result from data/sentiment-transitions.csv', 'none', '']
         # Check data/
-        elif db is None and path.exists('data/database.csv'):
-            logger.info('Sentiment scores not in memory, loading data/database.csv')
-            db = pd.read_csv('data/database.csv')
+        elif db is None and database.exists():
+            logger.info('Sentiment scores not in memory, loading data/database/')
+            db = database.read(text_dtype='string[pyarrow]')
             if 'senti_avg' in db:
                 SentiTransition().calculate_transitions(db['senti_avg'].values)
                 data = None
@@ -130,16 +146,16 @@ def determine_analysis(what: str):
         if db is not None and 'senti_avg' in db:
             logger.info('Sentiment scores found in memory, using those values')
             # Create the categorized object and start categorization
-            Categorizer(db).categorize_main()
-            return ['block', 'Threads Categorized! You can view the result in the file data/database.csv', 'none', '']
+            Categorizer(db, workers=cpu_count()).categorize_main()
+            return ['block', 'Threads Categorized! You can view the result in data/database/', 'none', '']
         # Check data/
-        elif db is None and path.exists('data/database.csv'):
-            logger.info('Sentiment scores not in memory, loading data/database.csv')
-            db = pd.read_csv('data/database.csv')
+        elif db is None and database.exists():
+            logger.info('Sentiment scores not in memory, loading data/database/')
+            db = database.read(text_dtype='string[pyarrow]')
             if 'senti_avg' in db:
-                Categorizer(db).categorize_main()
+                Categorizer(db, workers=cpu_count()).categorize_main()
                 data = None  # Remove this from memory
-                return ['block', 'Threads Categorized! You can view the result in the file data/database.csv', 'none', '']
+                return ['block', 'Threads Categorized! You can view the result in data/database/', 'none', '']
             else:
                 return ['block', 'Please calculate sentiment scores first', 'none', '']
         # Sentiment scores not found
@@ -152,9 +168,9 @@ def determine_analysis(what: str):
             return ['block',
                     'Category Transitions calculated! You can view the results from data/category_transitions.csv',
                     'none', '']
-        elif db is None and path.exists('data/database.csv'):
-            logger.info('Loading data/database.csv')
-            db = pd.read_csv('data/database.csv')
+        elif db is None and database.exists():
+            logger.info('Loading data/database/')
+            db = database.read(text_dtype='string[pyarrow]')
             if 'simple_heuristic_cat' in db:
                 CategoryTransitions(db.simple_heuristic_cat, 'data/simple_transitions.csv').get_transitions()
                 return ['block',
@@ -168,21 +184,32 @@ def determine_analysis(what: str):
     elif what == 'kmeans-categorize':
         # Check memory
         if db is not None and 'simple_heuristic_cat' in db:
-            km_obj = KmeansCategorization(db)
-            km_obj.kmeans_main()
+            km_obj = KmeansCategorization(db, database.version(KMEANS_FEATURES))
+            # Train only once, later runs categorize with the saved model until the features change
+            try:
+                km_obj.kmeans_predict()
+            except (FileNotFoundError, ValueError) as e:
+                logger.info(f'Training K-means, the saved model can not be used: {e}')
+                km_obj.kmeans_main()
             kmeans_cat = km_obj.all_data.kmeans_cat
             kmeans_cat.to_csv('data/kmeans_categorization.csv', index=False)
+            database.write(db, 'kmeans', ['kmeans_cat'])
             km_obj = None  # Conserve memory
             return ['block',
                     "K-Means categorization done! Get more results with category transitions or K-means Zipf's Law",
                     'none', '']
-        elif db is None and path.exists('data/database.csv'):
-            db = pd.read_csv('data/database.csv')
+        elif db is None and database.exists():
+            db = database.read(text_dtype='string[pyarrow]')
             if 'simple_heuristic_cat' in db:
-                km_obj = KmeansCategorization(db)
-                km_obj.kmeans_main()
+                km_obj = KmeansCategorization(db, database.version(KMEANS_FEATURES))
+                try:
+                    km_obj.kmeans_predict()
+                except (FileNotFoundError, ValueError) as e:
+                    logger.info(f'Training K-means, the saved model can not be used: {e}')
+                    km_obj.kmeans_main()
                 kmeans_cat = km_obj.all_data.kmeans_cat
                 kmeans_cat.to_csv('data/kmeans_categorization.csv', index=False)
+                database.write(db, 'kmeans', ['kmeans_cat'])
                 km_obj = None  # Conserve memory
                 return ['block',
                         "K-Means categorization done! Get more results with category transitions or K-means Zipf's Law",
@@ -230,6 +257,8 @@ def display_transitions():
     """
     global what_to_do, logger
     logger.info('User accessing /transitions')
+    if 'column' in request.args:
+        return display_period_transitions(request.args)
     if what_to_do == 'visSentiTransitions':
         what_to_do = ''
         if not path.exists('data/sentiment-transitions.csv'):
@@ -267,23 +296,43 @@ def display_transitions():
         what_to_do = ''
         return render_template('transitions.html', display='block', msg='Something went wrong', data=[], len_rows=0, len_cols=0)
 
+def display_period_transitions(args):
+    """
+    Displays the transitions of the selected year and month, e.g. /transitions?column=kmeans_cat&year=2012&month=3
+    :param args: column, and optionally year and month. An empty year or month means all of them
+    :return: The transitions page
+    """
+    column = args.get('column')
+    if column not in PERIOD_COLUMNS:
+        return render_template('transitions.html', display='block', msg=f'Unknown column {column}', data=[], len_rows=0, len_cols=0)
+    try:
+        years = [int(args['year'])] if args.get('year', '') != '' else None
+        months = [int(args['month'])] if args.get('month', '') != '' else None
+    except ValueError:
+        return render_template('transitions.html', display='block', msg='Year and month must be numbers', data=[], len_rows=0, len_cols=0)
+    if not database.exists():
+        logger.info('No database found for the monthly transitions')
+        return render_template('transitions.html', display='block', msg='No data found, run the sentiment analysis first', data=[], len_rows=0, len_cols=0)
+    period_transitions = PeriodTransitions(database)
+    period_transitions.load_or_calculate()
+    table = period_transitions.query(column, years, months)
+    data = [['FROM/TO'] + table.columns.tolist()] + [[c] + row for c, row in zip(table.index, table.values.tolist())]
+    msg = f'{column} transitions of ' + (f'{years[0]}' if years else 'all years') + (f', month {months[0]}' if months else '')
+    return render_template('transitions.html', display='block', msg=msg, data=data, len_rows=len(data), len_cols=len(data[0]))
+
 @app.route('/correlation')
 def display_correlation():
     """
     This page calculates the correlation between sentiment and different indexes and displays it to the user ina table
     :return: The correlation page with a possible error message
     """
-    global db, logger
+    global logger
     logger.info('User accessing /correlation')
-    if db is not None and 'senti_avg' in db and len(db.year.unique().tolist()) >= 9:
-        logger.info('Sentiment scores found in memory, using those values')
-        corr = SentiCorrelation(db[['year', 'senti_avg']]).correlation()
-        return render_template('correlation.html', correlations=corr, len=len(corr), display='none', msg='')
-    elif db is None and path.exists('data/database.csv'):
-        logger.info('Sentiment scores not in memory, loading data/database.csv')
-        db = pd.read_csv('data/database.csv')
-        if 'senti_avg' in db and len(db.year.unique().tolist()) >= 9:
-            corr = SentiCorrelation(db[['year', 'senti_avg']]).correlation()
+    if database.exists() and 'senti_avg' in database.columns():
+        logger.info('Loading the yearly sentiment averages from data/senti_rollup.csv')
+        stats = SentiRollup(database).stats('senti_avg', 'year')
+        if len(stats) >= 9:
+            corr = SentiCorrelation(year_averages=dict(zip(stats['year'], stats['avg']))).correlation()
             return render_template('correlation.html', correlations=corr, len=len(corr), display='none', msg='')
         else:
             return render_template('correlation.html', correlations=[], len=0, display='block',
@@ -317,23 +366,20 @@ def create_figure():
     axis.set_title('No Data')
     # Sentiment Evolution
     if what_to_do == 'visSenti':
-        if db is not None and 'senti_avg' in db:
+        if database.exists() and 'senti_avg' in database.columns():
+            # Monthly averages from data/senti_rollup.csv, without reading the scores
+            fig = SentiPlot().draw_to_gui(stats=SentiRollup(database).stats('senti_avg', 'month'))
+        elif db is not None and 'senti_avg' in db:
             fig = SentiPlot().draw_to_gui(db[['year', 'month', 'senti_avg']])
-        elif db is None and path.exists('data/database.csv'):
-            db = pd.read_csv('data/database.csv')
-            if 'senti_avg' in db:
-                fig = SentiPlot().draw_to_gui(db[['year', 'month', 'senti_avg']])
-            else:
-                axis.set_title('No Data, please run the corresponding analysis')
         else:
             axis.set_title('No Data, please run the corresponding analysis')
     # Zipf's Law for Simple heuristic
     elif what_to_do == 'zipf':
         if db is not None and 'simple_heuristic_cat' in db:
             fig = ZipfsLaw(db.simple_heuristic_cat).fit_zipfs_law()
-        elif db is None and path.exists('data/database.csv'):
-            logger.info('Loading data/database.csv')
-            db = pd.read_csv('data/database.csv')
+        elif db is None and database.exists():
+            logger.info('Loading data/database/')
+            db = database.read(text_dtype='string[pyarrow]')
             if 'simple_heuristic_cat' in db:
                 fig = ZipfsLaw(db.simple_heuristic_cat).fit_zipfs_law()
             else:
@@ -341,6 +387,13 @@ def create_figure():
         else:
             axis.set_title('No Data, please run the corresponding analysis')
 
+    # Number of clusters for K-means
+    elif what_to_do == 'kmeans-selection':
+        if database.exists() and 'n_of_words_text' in database.columns():
+            selection = KmeansSelection(database, workers=cpu_count())
+            fig = selection.draw_to_gui(selection.select())
+        else:
+            axis.set_title('No Data, please run the corresponding analysis')
     # Zipf's Law for K-means
     elif what_to_do =='kmeans-zipf':
         if kmeans_cat is not None:
@@ -0,0 +1,89 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+
+from Senti24.categorization import Categorizer
+from Senti24.storage import apply_schema
+
+nan = np.nan
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Features of a thread no rule applies to, each case below changes some of them
+BASE = {'n_of_words_text': 100, 'text_s_sum': 0, 'n_of_swear_words': 0, 'n_of_neg_adjectives': 0,
+        'n_of_pos_adjectives': 0, 'n_of_question_words': 0, 'n_of_question_marks': 0,
+        'pos_adj_avg_sentiment': 0.0, 'neg_adj_avg_sentiment': 0.0}
+# Categories given by the original if/elif implementation of the simple heuristic, at both sides of every
+# threshold and with missing features
+GOLDEN = [
+    ({}, 'Announcement'),
+    ({'n_of_words_text': 300}, 'Announcement'),
+    ({'n_of_words_text': 301}, 'Narration'),
+    ({'n_of_words_text': 301, 'text_s_sum': -2}, 'Narration'),
+    ({'n_of_words_text': 301, 'text_s_sum': -3}, 'Negative Narration'),
+    ({'n_of_words_text': 301, 'n_of_swear_words': 20}, 'Narration'),
+    ({'n_of_words_text': 301, 'n_of_swear_words': 21}, 'Negative Narration'),
+    ({'n_of_words_text': 301, 'n_of_neg_adjectives': 10}, 'Narration'),
+    ({'n_of_words_text': 301, 'n_of_neg_adjectives': 11}, 'Negative Narration'),
+    ({'n_of_words_text': 301, 'n_of_neg_adjectives': 11, 'n_of_pos_adjectives': 11}, 'Narration'),
+    ({'n_of_words_text': 301, 'text_s_sum': 2}, 'Narration'),
+    ({'n_of_words_text': 301, 'text_s_sum': 3}, 'Positive Narration'),
+    ({'n_of_words_text': 301, 'n_of_pos_adjectives': 11}, 'Positive Narration'),
+    ({'n_of_words_text': 301, 'n_of_pos_adjectives': 11, 'n_of_neg_adjectives': 12}, 'Negative Narration'),
+    ({'n_of_question_words': 1, 'n_of_question_marks': 1, 'n_of_words_text': 39}, 'Question'),
+    ({'n_of_question_words': 1, 'n_of_question_marks': 1, 'n_of_words_text': 40}, 'Announcement'),
+    ({'n_of_question_words': 0, 'n_of_question_marks': 1, 'n_of_words_text': 10}, 'Announcement'),
+    ({'n_of_question_words': 1, 'n_of_question_marks': 0, 'n_of_words_text': 10}, 'Announcement'),
+    ({'pos_adj_avg_sentiment': 1.5}, 'Appreciation'),
+    ({'pos_adj_avg_sentiment': 1.49}, 'Announcement'),
+    ({'text_s_sum': 3}, 'Appreciation'),
+    ({'text_s_sum': 2}, 'Announcement'),
+    ({'n_of_pos_adjectives': 11, 'n_of_neg_adjectives': 10}, 'Appreciation'),
+    ({'n_of_pos_adjectives': 10}, 'Announcement'),
+    ({'neg_adj_avg_sentiment': -1.5}, 'Negative Reaction'),
+    ({'neg_adj_avg_sentiment': -1.49}, 'Announcement'),
+    ({'text_s_sum': -3}, 'Negative Reaction'),
+    ({'text_s_sum': -2}, 'Announcement'),
+    ({'n_of_swear_words': 11}, 'Negative Reaction'),
+    ({'n_of_swear_words': 10}, 'Announcement'),
+    ({'n_of_neg_adjectives': 11, 'n_of_pos_adjectives': 10}, 'Negative Reaction'),
+    ({'pos_adj_avg_sentiment': 1.5, 'neg_adj_avg_sentiment': -1.5}, 'Appreciation'),
+    ({'n_of_question_words': 1, 'n_of_question_marks': 1, 'n_of_words_text': 10, 'text_s_sum': 5},
+     'Question'),
+    ({'n_of_words_text': nan}, 'Announcement'),
+    ({'n_of_words_text': nan, 'text_s_sum': 5}, 'Appreciation'),
+    ({'n_of_words_text': nan, 'n_of_question_words': 1, 'n_of_question_marks': 1}, 'Announcement'),
+    ({'text_s_sum': nan}, 'Announcement'),
+    ({'n_of_words_text': 301, 'text_s_sum': nan}, 'Narration'),
+    ({'n_of_words_text': 301, 'text_s_sum': nan, 'n_of_swear_words': nan,
+      'n_of_neg_adjectives': 11, 'n_of_pos_adjectives': nan}, 'Narration'),
+    ({'pos_adj_avg_sentiment': nan, 'neg_adj_avg_sentiment': nan}, 'Announcement'),
+    ({'pos_adj_avg_sentiment': nan, 'neg_adj_avg_sentiment': -2.0}, 'Negative Reaction'),
+    ({'n_of_pos_adjectives': 11, 'n_of_neg_adjectives': nan}, 'Announcement'),
+]
+
+
+def categorizer(data: pd.DataFrame) -> Categorizer:
+    # Only the rules are needed, not the lexicons and the feature store loaded by __init__
+    categorizer = Categorizer.__new__(Categorizer)
+    categorizer.logger = logging.getLogger('Categorizer')
+    categorizer.data = data
+    return categorizer
+
+
+@pytest.fixture
+def threads() -> pd.DataFrame:
+    # Same dtypes as in the database, missing counts are nullable integers
+    return apply_schema(pd.DataFrame([{**BASE, **features} for features, _ in GOLDEN]))
+
+
+def test_simple_heuristic(threads, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    categories = categorizer(threads).categorize_with_simple_heuristic()
+    assert list(categories) == [category for _, category in GOLDEN]
+
+
+def test_rule_set_columns(threads):
+    categories = categorizer(threads).categorize_with_rules(file=os.path.join(ROOT, 'data/category_rules.json'))
+    assert list(categories.columns) == ['simple_heuristic']
+    assert list(categories['simple_heuristic']) == [category for _, category in GOLDEN]
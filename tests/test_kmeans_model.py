@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+# Needs matplotlib, and a pandas that still has SettingWithCopyWarning
+pytest.importorskip('Senti24.kmeans_categorization', exc_type=ImportError)
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+from Senti24.kmeans_categorization import KmeansCategorization, KMEANS_FEATURES
+
+
+def fitted(monkeypatch, data_version: str) -> KmeansCategorization:
+    monkeypatch.setattr(KmeansCategorization, 'load_thread_ids', lambda self: ([], np.array([], dtype=np.int64)))
+    km = KmeansCategorization(data_version=data_version)
+    features = np.random.default_rng(10).integers(0, 10, (60, len(KMEANS_FEATURES)))
+    km.scaler = StandardScaler().fit(features)
+    km.km_final = KMeans(n_clusters=len(km.categories), random_state=10, n_init=1).fit(km.scaler.transform(features))
+    return km
+
+
+def test_model_of_other_features_is_rejected(tmp_path, monkeypatch):
+    file = str(tmp_path / 'kmeans_model.joblib')
+    fitted(monkeypatch, 'a').save_model(file)
+    KmeansCategorization(data_version='a').load_model(file)
+    KmeansCategorization().load_model(file)
+    with pytest.raises(ValueError):
+        KmeansCategorization(data_version='b').load_model(file)
+    # Models saved before the data version was stored
+    fitted(monkeypatch, None).save_model(file)
+    with pytest.raises(ValueError):
+        KmeansCategorization(data_version='a').load_model(file)
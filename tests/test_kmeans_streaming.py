@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+# Needs matplotlib, and a pandas that still has SettingWithCopyWarning
+pytest.importorskip('Senti24.kmeans_categorization', exc_type=ImportError)
+from Senti24.kmeans_categorization import KmeansCategorization, KMEANS_FEATURES
+from Senti24.storage import Database
+
+THREADS = 200
+# 2009 has training threads, 2010 only threads with ids, 2019 no threads with ids
+MONTHS = [(2009, 1), (2010, 1), (2019, 1)]
+
+
+def make_database(root: str) -> (Database, [np.ndarray]):
+    rng = np.random.default_rng(10)
+    frames, ids_by_month = [], []
+    for i, (year, month) in enumerate(MONTHS):
+        ids = np.arange(THREADS, dtype=np.int64) + i * THREADS
+        df = pd.DataFrame({'thread_id': ids, 'year': year, 'month': month,
+                           'datetime': [f'{year}-{month:02}-01 00:00:{s % 60:02}' for s in range(THREADS)]})
+        for col in KMEANS_FEATURES:
+            df[col] = rng.integers(0, 10, THREADS)
+        df['senti_avg'] = rng.integers(-8, 8, THREADS) / 2
+        frames.append(df)
+        ids_by_month.append(ids)
+    database = Database(root)
+    database.write(pd.concat(frames, ignore_index=True), 'sentiment')
+    return database, ids_by_month
+
+
+def test_streaming_skips_months_without_training_threads(tmp_path, monkeypatch):
+    database, ids_by_month = make_database(str(tmp_path / 'database'))
+    train_ids = np.sort(ids_by_month[0])
+    all_ids = np.sort(np.concatenate(ids_by_month[:2]))
+    monkeypatch.setattr(KmeansCategorization, 'load_thread_ids', lambda self: (ids_by_month[:2], all_ids))
+    monkeypatch.setattr(KmeansCategorization, 'sample_ids', lambda self: (train_ids, all_ids))
+    output = str(tmp_path / 'kmeans_categorization.csv')
+
+    km = KmeansCategorization()
+    km.kmeans_streaming(database, batch_size=100, reference=str(tmp_path / 'missing.joblib'),
+                        save_to=str(tmp_path / 'kmeans_streaming_model.joblib'), output=output)
+
+    categories = pd.read_csv(output).kmeans_cat
+    assert len(categories) == len(all_ids)
+    assert categories.str.startswith('Cluster ').all()
+    assert os.path.exists(tmp_path / 'kmeans_streaming_model.joblib')
+    # Without a reference model the clusters are not named and the database is not written
+    assert 'kmeans_cat' not in database.columns()
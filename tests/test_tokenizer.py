@@ -0,0 +1,40 @@
+import random
+import pytest
+
+from Senti24.tokenizer import tokenize
+
+nltk = pytest.importorskip('nltk')
+
+# Characters kept by the preprocessing
+CHARACTERS = 'abcdefghijklmnopqrstuvwxyzåäö-_!? '
+# Words word_tokenize splits with its contraction rules, and words that only look like them
+WORDS = ['cannot', 'Cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna', 'cannotx', 'xgonna', 'wannabe',
+         'en', 'voi', 'ei', 'mitä', 'öö', '-', '--', '---', '!', '?', '_', 'a-b']
+
+
+def word_tokenize(text: str) -> [str]:
+    return nltk.word_tokenize(text, preserve_line=True)
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ('cannot go', ['can', 'not', 'go']),
+    ('i wanna', ['i', 'wan', 'na']),
+    ('wanna?', ['wan', 'na', '?']),
+    ('wanna-x', ['wanna-x']),
+    ('gimme lemme gonna gotta', ['gim', 'me', 'lem', 'me', 'gon', 'na', 'got', 'ta']),
+    ('en voi--gonna!', ['en', 'voi', '--', 'gon', 'na', '!']),
+    ('mitä ihmettä?!', ['mitä', 'ihmettä', '?', '!']),
+    ('a, b: c.', ['a', ',', 'b', ':', 'c', '.']),
+])
+def test_tokens(text, tokens):
+    assert tokenize(text) == tokens
+    assert word_tokenize(text) == tokens
+
+
+def test_same_as_word_tokenize():
+    rng = random.Random(10)
+    texts = [''.join(rng.choice(CHARACTERS) for _ in range(rng.randint(0, 30))) for _ in range(3000)]
+    texts += [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))) for _ in range(3000)]
+    texts += [''.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))) for _ in range(3000)]
+    for text in texts:
+        assert tokenize(text) == word_tokenize(text), text